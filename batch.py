@@ -0,0 +1,223 @@
+"""
+File: batch.py
+Author: Adam Applegate
+Description: 
+
+    Command line entry point that filters many images at once without the UI.
+    Each worker process decodes, filters and encodes its own files, so the
+    three stages of different images run at the same time
+
+    Usage: python batch.py "media/*.jpg" --filter Sketch --output temp/batch --workers 4
+           python batch.py media --filter Noisy --param seed=7 --param color=true
+   
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+import filter_registry
+from image_loader import IMAGE_EXTENSIONS
+from image_processor import ImageProcessor
+
+# One processor per worker process, created by init_worker
+image_processor = None
+
+
+def init_worker():
+    """ Sets up a worker process """
+
+    global image_processor
+    image_processor = ImageProcessor(memoize=False)
+
+    # Each process gets its own core, so keep OpenCV from spawning threads of its own
+    cv2.setNumThreads(1)
+
+
+def find_images(inputs):
+    """ Expands directories (recursively) and glob patterns into a sorted list of image paths.
+        Returns (root, path) pairs, where root is used to mirror the folder structure in the output """
+
+    found = []
+
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for folder, _, files in os.walk(pattern):
+                for file in files:
+                    if file.lower().endswith(IMAGE_EXTENSIONS):
+                        found.append((pattern, os.path.join(folder, file)))
+
+        else:
+            for path in glob.glob(pattern, recursive=True):
+                if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                    found.append((os.path.dirname(pattern.split('*')[0]) or '.', path))
+
+    # Remove duplicates while keeping the first root each path was found under
+    unique = {}
+    for root, path in found:
+        unique.setdefault(os.path.normpath(path), root)
+
+    return sorted((root, path) for path, root in unique.items())
+
+
+def parse_param(spec, text):
+    """ Parses a name=value filter parameter. The value is converted to the type of the parameter's default.
+        Raises ValueError if the filter has no such parameter or the value doesn't fit it """
+
+    name, separator, value = text.partition('=')
+    name = name.strip()
+    value = value.strip()
+
+    if separator == '':
+        raise ValueError(f'{text} is not in the form name=value')
+
+    if name not in spec.params:
+        raise ValueError(f'{spec.name} has no parameter {name}. Its parameters are: {", ".join(spec.params) or "none"}')
+
+    default = spec.params[name]
+
+    # Checked before int, since bools are ints too
+    if isinstance(default, bool):
+        if value.lower() not in ('true', 'false', '1', '0', 'yes', 'no'):
+            raise ValueError(f'{name} must be true or false')
+        return name, value.lower() in ('true', '1', 'yes')
+
+    if isinstance(default, str):
+        return name, value
+
+    # Parameters without a default, like a seed, are whole numbers or none
+    if default is None and value.lower() == 'none':
+        return name, None
+
+    whole = default is None or isinstance(default, int)
+
+    try:
+        return name, int(value) if whole else float(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a {"whole number" if whole else "number"}') from None
+
+
+def process_file(path, output_path, filter, brightness, contrast, sharpness, params=None):
+    """ Decodes, filters and encodes a single image. Returns the time each stage took, in seconds.
+        params are passed on to the filter """
+
+    start = time.perf_counter()
+    image = cv2.imread(path)
+    if image is None:
+        raise ValueError(f'could not decode {path}')
+    decoded = time.perf_counter()
+
+    if filter is not None:
+        image = image_processor.filter_image(filter, image, **(params or {}))
+
+    if brightness != 0 or contrast != 0 or sharpness != 0:
+        image = image_processor.filter_apply_scales(brightness, contrast, sharpness, image)
+    filtered = time.perf_counter()
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    if not cv2.imwrite(output_path, image):
+        raise ValueError(f'could not encode {output_path}')
+    encoded = time.perf_counter()
+
+    return decoded - start, filtered - decoded, encoded - filtered
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Apply Filter Free filters to many images at once.')
+
+    parser.add_argument('inputs', nargs='+', help='image files, directories or glob patterns')
+    parser.add_argument('-f', '--filter', choices=filter_registry.names(), help='filter to apply')
+    parser.add_argument('-b', '--brightness', type=int, default=0, help='brightness from -255 to 255')
+    parser.add_argument('-c', '--contrast', type=int, default=0, help='contrast from -127 to 127')
+    parser.add_argument('-s', '--sharpness', type=int, default=0, help='sharpness from 0 to 100')
+    parser.add_argument('-p', '--param', action='append', default=[], metavar='NAME=VALUE',
+                        help='filter parameter, e.g. seed=7 for Noisy. Can be given more than once')
+    parser.add_argument('-o', '--output', default='temp/batch', help='folder to write the results to')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+
+    args = parser.parse_args(argv)
+
+    if args.filter is None and args.brightness == 0 and args.contrast == 0 and args.sharpness == 0:
+        parser.error('nothing to do. Pass a filter and/or scale values')
+
+    args.params = {}
+    if len(args.param) > 0:
+        if args.filter is None:
+            parser.error('--param needs a --filter')
+
+        spec = filter_registry.get(args.filter)
+        for text in args.param:
+            try:
+                name, value = parse_param(spec, text)
+            except ValueError as error:
+                parser.error(f'--param {error}')
+
+            args.params[name] = value
+
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    # The same ranges as the sliders in the UI. Contrast past them divides by zero
+    if not -255 <= args.brightness <= 255:
+        parser.error('--brightness must be from -255 to 255')
+
+    if not -127 <= args.contrast <= 127:
+        parser.error('--contrast must be from -127 to 127')
+
+    if not 0 <= args.sharpness <= 100:
+        parser.error('--sharpness must be from 0 to 100')
+
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    images = find_images(args.inputs)
+    if len(images) == 0:
+        print('No images found.')
+        return 1
+
+    print(f'Processing {len(images)} images with {args.workers} workers...')
+
+    failures = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as executor:
+        jobs = {}
+        for root, path in images:
+            output_path = os.path.join(args.output, os.path.relpath(path, root))
+            job = executor.submit(process_file, path, output_path, args.filter,
+                                  args.brightness, args.contrast, args.sharpness, args.params)
+            jobs[job] = path
+
+        for job in as_completed(jobs):
+            path = jobs[job]
+            try:
+                decode_time, filter_time, encode_time = job.result()
+            except Exception as error:
+                failures = failures + 1
+                print(f'FAILED  {path}: {error}')
+                continue
+
+            total_time = decode_time + filter_time + encode_time
+            print(f'{total_time * 1000:9.1f} ms  (decode {decode_time * 1000:.1f}, filter {filter_time * 1000:.1f}, '
+                  f'encode {encode_time * 1000:.1f})  {path}')
+
+    elapsed = time.perf_counter() - start
+    processed = len(images) - failures
+
+    print(f'Processed {processed} images in {elapsed:.2f} s ({processed / elapsed:.2f} images/second)')
+    if failures > 0:
+        print(f'{failures} images failed')
+
+    return 1 if failures > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,316 @@
+"""
+File: benchmark.py
+Author: Adam Applegate
+Description: 
+
+    Measures how fast every filter and processor entry point runs on the
+    bundled media, on synthetic images at several resolutions and on a
+    synthetic video. Results are written as JSON and can be compared against
+    a stored baseline, failing if anything got slower than a threshold
+
+    Usage: python benchmark.py --output temp/benchmark.json --baseline benchmark_baseline.json
+   
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import cv2
+
+import filter_registry
+import filters
+import tiling
+from image_processor import ImageProcessor
+from video_processor import VideoProcessor
+
+# Synthetic image sizes as (name, width, height)
+SYNTHETIC_SIZES = (
+    ('1mp', 1280, 800),
+    ('4mp', 2560, 1600),
+    ('12mp', 4256, 2832),
+    ('24mp', 6000, 4000),
+)
+
+# Synthetic video: frame count, width, height and frame rate
+SYNTHETIC_VIDEO = (48, 1280, 720, 24)
+
+# Default slowdown, as a fraction, that counts as a regression
+DEFAULT_THRESHOLD = 0.25
+
+
+def synthetic_image(width, height, seed=0):
+    """ A reproducible image with smooth gradients, edges and noise, so filters have real work to do """
+
+    rng = np.random.default_rng(seed)
+
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:, :, 0] = x
+    image[:, :, 1] = y
+    image[:, :, 2] = (x + y) / 2
+
+    for _ in range(20):
+        center = (int(rng.integers(width)), int(rng.integers(height)))
+        color = tuple(int(value) for value in rng.integers(0, 256, 3))
+        cv2.circle(image, center, int(rng.integers(10, max(11, min(width, height) // 4))), color, -1)
+
+    noise = rng.integers(0, 16, image.shape, dtype=np.uint8)
+    cv2.add(image, noise, dst=image)
+
+    return image
+
+
+def synthetic_video(path):
+    """ Writes a short synthetic video and returns its path """
+
+    frame_count, width, height, fps = SYNTHETIC_VIDEO
+    base = synthetic_image(width, height)
+
+    video_writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    for frame_num in range(frame_count):
+        video_writer.write(np.roll(base, frame_num * 8, axis=1))
+    video_writer.release()
+
+    return path
+
+
+def load_images(include_media, sizes):
+    """ Returns (name, image) pairs for every input image """
+
+    images = []
+
+    if include_media:
+        for path in sorted(glob.glob('media/*')):
+            image = cv2.imread(path)
+            if image is not None:
+                images.append((path, image))
+
+    for name, width, height in SYNTHETIC_SIZES:
+        if name in sizes:
+            images.append((f'synthetic-{name}', synthetic_image(width, height)))
+
+    return images
+
+
+def measure(function, repeat):
+    """ Runs a function repeat times. Returns the median wall time and the peak traced memory.
+        Memory is measured with tracemalloc, which sees numpy arrays (including OpenCV results)
+        but not OpenCV's internal scratch buffers """
+
+    # Warm up caches, lazy imports and OpenCV's thread pool
+    function()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return statistics.median(times), peak
+
+
+def image_cases(image_processor):
+    """ Returns (name, function(image)) for every filter and image entry point """
+
+    cases = []
+
+    # Parameters that make each filter do real work. Random filters get a seed so runs are comparable,
+    # and memoized stages are skipped so repeat runs aren't served from the memo
+    case_params = {'Noisy': {'seed': 0}, 'Scales': {'brightness': 40, 'contrast': 30},
+                   'Cartoon-Thick': {'memoize': False}, 'Cartoon-Thin': {'memoize': False}}
+
+    for spec in filter_registry.specs(menu_only=False):
+        params = case_params.get(spec.name, {})
+        cases.append((f'filter:{spec.name}', lambda image, spec=spec, params=params: spec.apply(image, **params)))
+
+    cases.append(('filter:brightness', filters.brightness))
+    cases.append(('filter:sharpness', lambda image: filters.brightness_contrast_sharpness(20, 20, 30, image)))
+
+    cases.append(('ImageProcessor.filter_image:Sketch', lambda image: image_processor.filter_image('Sketch', image)))
+    cases.append(('ImageProcessor.filter_apply_scales', lambda image: image_processor.filter_apply_scales(40, 30, 0, image)))
+    cases.append(('ImageProcessor.make_proxy', lambda image: image_processor.make_proxy(image, 1080, 720)))
+    cases.append(('tiling.filter_tiled:Emboss', lambda image: tiling.filter_tiled('Emboss', image)))
+
+    return cases
+
+
+def sharpness_error(image, sharpness_scale):
+    """ Measures how far the fast sharpness preview is from the quality path, in 8-bit levels.
+        The detail_ figures compare only the detail enhancement stage, before the final 3x3
+        sharpening kernel amplifies the differences """
+
+    reference = filters.brightness_contrast_sharpness(0, 0, 30, image)
+    fast = filters.brightness_contrast_sharpness(0, 0, 30, image, sharpness_mode='fast', sharpness_scale=sharpness_scale)
+    difference = cv2.absdiff(fast, reference)
+
+    detail_reference = cv2.detailEnhance(image, sigma_s=10, sigma_r=0.3)
+    detail_fast = filters.detail_enhance_fast(image, sigma_s=10, sigma_r=0.3, scale=sharpness_scale)
+    detail_difference = cv2.absdiff(detail_fast, detail_reference)
+
+    return {
+        'mean_abs_error': float(np.mean(difference)),
+        'p99_abs_error': float(np.percentile(difference, 99)),
+        'max_abs_error': int(difference.max()),
+        'detail_mean_abs_error': float(np.mean(detail_difference)),
+        'detail_p99_abs_error': float(np.percentile(detail_difference, 99)),
+    }
+
+
+def run(args):
+    # No result cache, no memoized stages and no automatic tiling, so every run measures the real work
+    image_processor = ImageProcessor(cache=None, tile_threshold=None, memoize=False)
+
+    cases = image_cases(image_processor)
+    if args.filters:
+        cases = [case for case in cases if any(name in case[0] for name in args.filters)]
+
+    results = []
+
+    for image_name, image in load_images(not args.no_media, args.sizes):
+        megapixels = image.shape[0] * image.shape[1] / 1e6
+
+        for case_name, function in cases:
+            seconds, peak = measure(lambda: function(image), args.repeat)
+            results.append(record(case_name, image_name, seconds, megapixels, peak))
+
+            print(f'{case_name:40} {image_name:30} {seconds * 1000:9.1f} ms {megapixels / seconds:8.1f} MP/s '
+                  f'{peak / 1e6:8.1f} MB')
+
+        # Accuracy of the fast sharpness preview at each quality setting
+        for sharpness_scale in (1.0, 0.5, 0.25):
+            case_name = f'filter:sharpness-fast-{sharpness_scale}'
+            if args.filters and not any(name in case_name for name in args.filters):
+                continue
+
+            function = lambda: filters.brightness_contrast_sharpness(20, 20, 30, image, sharpness_mode='fast',
+                                                                     sharpness_scale=sharpness_scale)
+            seconds, peak = measure(function, args.repeat)
+            result = record(case_name, image_name, seconds, megapixels, peak)
+            result['error'] = sharpness_error(image, sharpness_scale)
+            results.append(result)
+
+            print(f'{case_name:40} {image_name:30} {seconds * 1000:9.1f} ms {megapixels / seconds:8.1f} MP/s '
+                  f'{peak / 1e6:8.1f} MB  error {result["error"]["mean_abs_error"]:.2f} mean, '
+                  f'{result["error"]["p99_abs_error"]:.0f} p99 (detail stage {result["error"]["detail_mean_abs_error"]:.2f} mean, '
+                  f'{result["error"]["detail_p99_abs_error"]:.0f} p99)')
+
+    if not args.no_video:
+        with tempfile.TemporaryDirectory() as folder:
+            input_path = synthetic_video(os.path.join(folder, 'input.mp4'))
+            output_path = os.path.join(folder, 'output.mp4')
+
+            frame_count, width, height, _ = SYNTHETIC_VIDEO
+            megapixels = frame_count * width * height / 1e6
+            video_processor = VideoProcessor()
+
+            for filter in ('Invert', 'Sketch'):
+                case_name = f'VideoProcessor.filter_video:{filter}'
+                if args.filters and not any(name in case_name for name in args.filters):
+                    continue
+
+                seconds, peak = measure(lambda: video_processor.filter_video(filter, input_path, output_path,
+                                                                             progress_interval=float('inf')), 1)
+                results.append(record(case_name, 'synthetic-video', seconds, megapixels, peak))
+
+                print(f'{case_name:40} {"synthetic-video":30} {seconds * 1000:9.1f} ms {megapixels / seconds:8.1f} MP/s '
+                      f'{peak / 1e6:8.1f} MB')
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+
+
+def record(case_name, image_name, seconds, megapixels, peak):
+    return {
+        'case': case_name,
+        'input': image_name,
+        'seconds': seconds,
+        'megapixels': megapixels,
+        'megapixels_per_second': megapixels / seconds,
+        'peak_bytes': peak,
+    }
+
+
+def compare(report, baseline, threshold):
+    """ Prints how each result changed since the baseline. Returns the results that regressed """
+
+    previous = {(result['case'], result['input']): result for result in baseline['results']}
+    regressions = []
+
+    for result in report['results']:
+        old = previous.get((result['case'], result['input']))
+        if old is None:
+            continue
+
+        change = result['seconds'] / old['seconds'] - 1
+        if change > threshold:
+            regressions.append((result, change))
+
+    for result, change in regressions:
+        print(f'REGRESSION  {result["case"]} on {result["input"]}: {change * 100:.0f}% slower')
+
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Filter Free filters and processors.')
+
+    parser.add_argument('-o', '--output', default='temp/benchmark.json', help='where to write the results')
+    parser.add_argument('-b', '--baseline', help='results file to compare against')
+    parser.add_argument('-t', '--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='slowdown that counts as a regression, as a fraction (default 0.25)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='timed runs per case. The median is kept')
+    parser.add_argument('-f', '--filters', nargs='+', help='only run cases whose name contains one of these')
+    parser.add_argument('--sizes', nargs='+', default=[name for name, _, _ in SYNTHETIC_SIZES],
+                        choices=[name for name, _, _ in SYNTHETIC_SIZES], help='synthetic image sizes to run')
+    parser.add_argument('--no-media', action='store_true', help='skip the images in media/')
+    parser.add_argument('--no-video', action='store_true', help='skip the synthetic video')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    report = run(args)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+        if len(compare(report, baseline, args.threshold)) > 0:
+            return 1
+
+        print('No regressions.')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+File: display_surface.py
+Author: Adam Applegate
+Description:
+
+    Draws images on a Tkinter canvas. The canvas keeps a single image item,
+    and its PhotoImage is updated in place with paste() instead of adding a
+    new item for every refresh or video frame. The fitted, display sized copy
+    of the last image is kept, so redrawing the same result doesn't resize
+    and convert it again
+
+"""
+
+import cv2
+from PIL import ImageTk, Image
+
+import instrumentation
+import pixel_format
+
+
+def make_photo_image(image):
+    """ Returns a new PhotoImage of a BGR (or grayscale) image, for widgets that show small, fixed images """
+
+    return ImageTk.PhotoImage(Image.fromarray(pixel_format.for_display(image)))
+
+
+class DisplaySurface():
+    """ A single image shown in the centre of a Tkinter canvas """
+
+    def __init__(self, canvas, width, height):
+        self.canvas = canvas
+
+        # Size of the area images are fitted into
+        self.width = width
+        self.height = height
+
+        # The canvas image item, and the PhotoImage it shows. Created on the first draw
+        self.item = None
+        self.photo = None
+        self.photo_mode = None
+
+        # The last image drawn, and its display sized copy
+        self.source = None
+        self.fitted = None
+
+
+    def fit_scale(self, image_width, image_height):
+        """ Returns how much an image must be shrunk by to fit the display area. Images are never enlarged """
+
+        return min(self.width / image_width, self.height / image_height, 1.0)
+
+
+    def fit(self, image):
+        """ Returns a copy of the image shrunk to fit the display area, in a layout PIL can display """
+
+        image_height, image_width = image.shape[:2]
+        scale = self.fit_scale(image_width, image_height)
+
+        # If the image is larger than the display area, resize it to fit
+        if (scale < 1.0):
+            size = (max(1, round(image_width * scale)), max(1, round(image_height * scale)))
+            with instrumentation.span('display.resize'):
+                image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+        # Make sure the correct color channels are selected. Done after resizing, so fewer pixels are converted
+        return pixel_format.for_display(image)
+
+
+    def show(self, image):
+        """ Draws an image on the canvas, replacing whatever was there """
+
+        # The same result is already on the canvas
+        if (image is self.source and self.item is not None):
+            return
+
+        self.fitted = self.fit(image)
+        self.source = image
+
+        with instrumentation.span('display.photo_image'):
+            picture = Image.fromarray(self.fitted)
+
+            # A PhotoImage can only be updated in place if the size and mode still match
+            if (self.photo is None or self.photo.width() != picture.width or
+                    self.photo.height() != picture.height or self.photo_mode != picture.mode):
+                self.photo = ImageTk.PhotoImage(picture.mode, picture.size)
+                self.photo_mode = picture.mode
+
+            self.photo.paste(picture)
+
+        with instrumentation.span('display.draw'):
+            if (self.item is None):
+                self.item = self.canvas.create_image(self.width // 2, self.height // 2, image=self.photo)
+            else:
+                self.canvas.itemconfigure(self.item, image=self.photo)
+
+
+    def clear(self):
+        """ Removes the image from the canvas """
+
+        if (self.item is not None):
+            self.canvas.delete(self.item)
+
+        self.item = None
+        self.photo = None
+        self.photo_mode = None
+        self.source = None
+        self.fitted = None
@@ -0,0 +1,210 @@
+"""
+File: filter_registry.py
+Author: Adam Applegate
+Description: 
+
+    Declares every filter the program knows about, along with the metadata
+    the processors need to schedule it (tiling, caching, parallelism).
+    Filter modules are only imported the first time a filter is used
+   
+"""
+
+import importlib
+
+from pixel_format import BGR, GRAY
+
+
+class FilterSpec():
+    """ Describes a single filter """
+
+    def __init__(self, name, module, function, args=None, params=None, channels_in=(BGR,), halo=0, tileable=True,
+                 deterministic=True, menu=True, scale_params=None, preview_params=None, version=1):
+        # The name shown to the user
+        self.name = name
+
+        # Bump whenever the filter's output changes, so results cached by older code aren't reused
+        self.version = version
+
+        # Where the filter function lives. It is imported on first use
+        self.module = module
+        self.function_name = function
+
+        # Fixed keyword arguments that select this variant of the function
+        self.args = args or {}
+
+        # Tunable keyword arguments and their default values
+        self.params = params or {}
+
+        # The pixel_format layouts the filter accepts, or None for any.
+        # Images in any other layout are converted to the first accepted one before filtering
+        self.channels_in = channels_in
+
+        # How many pixels of neighborhood each output pixel reads, per side.
+        # Either a number, or halo(params) for filters whose kernel size is a parameter
+        self.halo = halo
+
+        self.tileable = tileable
+        self.deterministic = deterministic
+
+        # Whether the filter is listed in the filter dropdown
+        self.menu = menu
+
+        # scale_params(params, scale) adjusts size-based parameters, so the filter looks the
+        # same on an image resized by scale. None if the filter doesn't depend on image size
+        self.scale_params = scale_params
+
+        # Parameters that swap in faster, approximate settings for interactive previews
+        self.preview_params = preview_params or {}
+
+        self._function = None
+
+
+    @property
+    def function(self):
+        """ The filter function, imported the first time it is needed """
+
+        if self._function is None:
+            module = importlib.import_module(self.module)
+            self._function = getattr(module, self.function_name)
+
+        return self._function
+
+
+    def is_deterministic(self, params):
+        """ Whether running the filter with these parameters gives the same result every time.
+            Random filters become deterministic when given a seed """
+
+        return self.deterministic or params.get('seed') is not None
+
+
+    def halo_for(self, params):
+        """ Returns the halo size for running the filter with these parameters """
+
+        if callable(self.halo):
+            full_params = dict(self.params)
+            full_params.update(params)
+
+            return self.halo(full_params)
+
+        return self.halo
+
+
+    def params_for_scale(self, params, scale):
+        """ Returns the parameters to use on a copy of the image resized by scale """
+
+        if self.scale_params is None or scale == 1.0:
+            return params
+
+        full_params = dict(self.params)
+        full_params.update(params)
+
+        return self.scale_params(full_params, scale)
+
+
+    def apply(self, image, **params):
+        """ Runs the filter on an image. params override the defaults in self.params """
+
+        unknown = set(params) - set(self.params)
+        if unknown:
+            raise TypeError(f'{self.name} got unexpected parameters: {", ".join(sorted(unknown))}')
+
+        kwargs = dict(self.args)
+        kwargs.update(self.params)
+        kwargs.update(params)
+
+        return self.function(image=image, **kwargs)
+
+
+def scale_kernel_size(size, scale):
+    """ Scales a kernel size, keeping it odd and at least 1 """
+
+    size = int(round(size * scale))
+
+    return max(1, size + 1 - size % 2)
+
+
+def sketch_halo(params):
+    return params['blur_size'] // 2
+
+
+def scale_sketch_params(params, scale):
+    return dict(params, blur_size=scale_kernel_size(params['blur_size'], scale))
+
+
+def scale_cartoon_params(params, scale):
+    return dict(params,
+                sigma_s=max(params['sigma_s'] * scale, 1.0),
+                median_size=scale_kernel_size(params['median_size'], scale),
+                block_size=max(3, scale_kernel_size(params['block_size'], scale)))
+
+
+def scale_scales_params(params, scale):
+    return dict(params, sigma_s=max(params['sigma_s'] * scale, 1.0))
+
+
+_registry = {}
+
+
+def register(spec):
+    """ Adds a filter to the registry, replacing any filter with the same name """
+
+    _registry[spec.name] = spec
+
+    return spec
+
+
+def get(name):
+    """ Returns the spec for a filter. Raises KeyError if the filter doesn't exist """
+
+    return _registry[name]
+
+
+def exists(name):
+    """ Returns True if a filter with this name is registered """
+
+    return name in _registry
+
+
+def names(menu_only=True):
+    """ Returns the filter names in registration order """
+
+    return [spec.name for spec in _registry.values() if spec.menu or not menu_only]
+
+
+def specs(menu_only=True):
+    """ Returns the filter specs in registration order """
+
+    return [spec for spec in _registry.values() if spec.menu or not menu_only]
+
+
+######################################
+# Built in filters
+######################################
+register(FilterSpec('Emboss', 'filters', 'emboss', channels_in=(BGR, GRAY), halo=1))
+
+# Lower sigma_s/sigma_r or raise the thresholds for faster, rougher previews
+CARTOON_PARAMS = {'sigma_s': 64, 'sigma_r': 0.25, 'canny_low': 100, 'canny_high': 200,
+                  'median_size': 5, 'block_size': 7, 'threshold_c': 7, 'memoize': True}
+
+register(FilterSpec('Cartoon-Thick', 'filters', 'cartoon', args={'type': 'thick'}, params=CARTOON_PARAMS,
+                    tileable=False, scale_params=scale_cartoon_params))
+
+register(FilterSpec('Cartoon-Thin', 'filters', 'cartoon', args={'type': 'thin'}, params=CARTOON_PARAMS,
+                    tileable=False, scale_params=scale_cartoon_params))
+
+register(FilterSpec('Sketch', 'filters', 'sketch', params={'blur_size': 21},
+                    channels_in=(BGR, GRAY), halo=sketch_halo, scale_params=scale_sketch_params))
+
+register(FilterSpec('Invert', 'filters', 'invert', channels_in=None))
+
+# Not tileable: the noise is drawn per call, so every tile would repeat the same pattern for a given seed
+register(FilterSpec('Noisy', 'filters', 'noisy',
+                    params={'thresh': 0.8, 'amplitude': 64, 'seed': None, 'color': False},
+                    channels_in=(BGR, GRAY), tileable=False, deterministic=False))
+
+# The brightness, contrast and sharpness scales. Not listed in the dropdown
+register(FilterSpec('Scales', 'filters', 'brightness_contrast_sharpness',
+                    params={'brightness': 0, 'contrast': 0, 'sharpness': 0, 'sigma_s': 10,
+                            'sharpness_mode': 'quality', 'sharpness_scale': 0.5},
+                    tileable=False, menu=False, scale_params=scale_scales_params,
+                    preview_params={'sharpness_mode': 'fast'}))
@@ -10,22 +10,22 @@ Description:
 import numpy as np
 import cv2
 
+import instrumentation
+import lut
+import pixel_format
+from result_cache import ResultCache
+
+# Remembers the smoothed base image of the last few cartoon sources (128 MB)
+smoothing_cache = ResultCache(max_bytes=128 * 1024 * 1024)
+
 # Credit to Vardan Agarwal- https://medium.com/@vardanagarwal16
+@instrumentation.timed('filters.brightness')
 def brightness(image):
 
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
 
-    hsv = np.array(hsv, dtype=np.float64)
-
-    # First Channel
-    hsv[:,:,1] = hsv[:,:,:1] * 1.25
-    hsv[:,:,1][hsv[:,:,:1] > 255] = 255
-
-    # Second Channel
-    hsv[:,:,2] = hsv[:,:,:2] * 1.25
-    hsv[:,:,2][hsv[:,:,:2] > 255] = 255
-
-    hsv = np.array(hsv, dtype= np.uint8)
+    # Boost the saturation and value channels by 25%, capped at 255
+    hsv = lut.apply_table(hsv, lut.saturation_value_table(1.25, 1.25))
 
     processed_image = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
 
@@ -34,31 +34,23 @@ def brightness(image):
 
 # Credit to Geeks for Geeks: https://www.geeksforgeeks.org/changing-the-contrast-and-brightness-of-an-image-using-python-opencv/
 # Credit to Vardan Agarwal- https://medium.com/@vardanagarwal16
-def brightness_contrast_sharpness(brightness, contrast, sharpness, image):
-    
-    if brightness != 0:
-        if brightness > 0:
-            shadow = brightness
-            highlight = 255
-        else:
-            shadow = 0
-            highlight = 255 + brightness
-        alpha_b = (highlight - shadow)/255
-        gamma_b = shadow
-        
-        buf = cv2.addWeighted(image, alpha_b, image, 0, gamma_b)
+@instrumentation.timed('filters.brightness_contrast_sharpness')
+def brightness_contrast_sharpness(brightness, contrast, sharpness, image, sigma_s=10, sharpness_mode='quality',
+                                  sharpness_scale=0.5):
+    """ sharpness_mode 'quality' uses cv2.detailEnhance. 'fast' uses detail_enhance_fast, which is
+        meant for interactive previews. sharpness_scale is its quality knob """
+
+    # Brightness and contrast are combined into one cached table and applied in a single pass
+    if brightness != 0 or contrast != 0:
+        buf = lut.apply_table(image, lut.brightness_contrast_table(brightness, contrast))
     else:
         buf = image
-    
-    if contrast != 0:
-        f = 131*(contrast + 127)/(127*(131-contrast))
-        alpha_c = f
-        gamma_c = 127*(1-f)
-        
-        buf = cv2.addWeighted(buf, alpha_c, buf, 0, gamma_c)
 
     if sharpness != 0:
-        buf = cv2.detailEnhance(buf, sigma_s=10, sigma_r=float(sharpness / 100))
+        if sharpness_mode == 'fast':
+            buf = detail_enhance_fast(buf, sigma_s=sigma_s, sigma_r=float(sharpness / 100), scale=sharpness_scale)
+        else:
+            buf = cv2.detailEnhance(buf, sigma_s=sigma_s, sigma_r=float(sharpness / 100))
 
         kernel_sharpening = np.array([[-1,-1,-1], 
                                 [-1, 9,-1],
@@ -68,132 +60,189 @@ def brightness_contrast_sharpness(brightness, contrast, sharpness, image):
 
     return buf
 
+@instrumentation.timed('filters.detail_enhance_fast')
+def detail_enhance_fast(image, sigma_s=10, sigma_r=0.15, scale=0.5):
+    """ An approximation of cv2.detailEnhance for previews.
+
+        detailEnhance smooths the Lab lightness channel with a recursive edge preserving filter
+        and boosts the difference 3x. This does the same, but smooths a copy shrunk by scale
+        (0 to 1) and scales it back up, then applies the boost in a single saturating pass.
+        At scale 1 or more it simply calls detailEnhance.
+        At scale 0.5 it is about 3x faster than detailEnhance. On the bundled media the mean absolute
+        error is about 1.1-1.5 levels, the 99th percentile 4-11, and the maximum up to about 80 levels
+        at a few high contrast edges. benchmark.py measures it """
+
+    if scale >= 1.0:
+        return cv2.detailEnhance(image, sigma_s=sigma_s, sigma_r=sigma_r)
+
+    height, width = image.shape[:2]
+
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2Lab)
+    lightness = lab[:, :, 0]
+
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    small = cv2.resize(lightness, size, interpolation=cv2.INTER_AREA)
+
+    # detailEnhance filters lightness in the 0-100 range. Filtering OpenCV's 0-255 lightness with sigma_r
+    # scaled by the same factor smooths identically, without rounding lightness to 101 levels first.
+    # The filter needs 3 channels, but constant channels don't change the edges it sees
+    zeros = np.zeros_like(small)
+    base = cv2.edgePreservingFilter(cv2.merge([small, zeros, zeros]), flags=cv2.RECURS_FILTER,
+                                    sigma_s=max(sigma_s * scale, 1.0), sigma_r=sigma_r * 255 / 100)[:, :, 0]
+
+    base = cv2.resize(base, (width, height), interpolation=cv2.INTER_LINEAR)
+
+    # lightness + 3 * (lightness - base)
+    lab[:, :, 0] = cv2.addWeighted(lightness, 3, base, -2, 0)
+
+    return cv2.cvtColor(lab, cv2.COLOR_Lab2BGR)
+
+
 def splash(filename, color1, color2):
     pass
 
 
 # Credit to Vardan Agarwal- https://medium.com/@vardanagarwal16
-def noisy(image):
+@instrumentation.timed('filters.noisy')
+def noisy(image, thresh=0.8, amplitude=64, seed=None, color=False):
+    """ Adds random noise to an image.
 
-    height, width = image.shape[:2]
+        thresh is the fraction of pixels that get noise (0.0 to 1.0), amplitude is the
+        exclusive upper bound of the noise added or subtracted (1 to 256). Pass a seed
+        for reproducible output. color=True adds noise to each channel separately
+        instead of converting to grayscale first """
 
-    processed_image = np.zeros((height, width), np.uint8)
+    if color:
+        processed_image = image.copy()
+    else:
+        processed_image = pixel_format.convert(image, pixel_format.GRAY)
 
-    grayscale = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    shape = processed_image.shape
+    rng = np.random.default_rng(seed)
 
-    # Determines how much noise to add to the image. Ranges from 0.0 to 1.0
-    thresh = 0.8
+    # Noise values from 0 to amplitude - 1, zeroed where no noise is added
+    noise = rng.integers(0, amplitude, size=shape, dtype=np.uint8)
+    noise[rng.random(shape, dtype=np.float32) > thresh] = 0
 
-    for i in range(height):
-        for j in range(width):
-            if (np.random.rand() <= thresh):
-                if (np.random.randint(2) == 0):
-                    # Add random values from 0-64. 255 is the upper bound
-                    grayscale[i, j] = min(grayscale[i, j] + np.random.randint(0, 64), 255)
-                else:
-                    # Subtract random values from 0-64. 0 is the lower bound
-                    grayscale[i, j] = max(grayscale[i, j] - np.random.randint(0, 64), 0)
+    # Split the noise into the values that are added and the ones that are subtracted
+    subtract = rng.integers(0, 2, size=shape, dtype=np.uint8).view(bool)
+    added_noise = noise.copy()
+    added_noise[subtract] = 0
+    noise[~subtract] = 0
 
-    processed_image = grayscale
+    # Saturating uint8 arithmetic keeps results between 0 and 255
+    cv2.add(processed_image, added_noise, dst=processed_image)
+    cv2.subtract(processed_image, noise, dst=processed_image)
 
     return processed_image
 
 
 # Credit to Vardan Agarwal- https://medium.com/@vardanagarwal16
+@instrumentation.timed('filters.emboss')
 def emboss(image):
 
-    height, width = image.shape[:2]
-
-    # Create an array the same size as the image, but it's gray
-    y = np.ones((height, width), np.uint8) * 128
-
-    # The final image will be stored here
-    processed_image = np.zeros((height, width), np.uint8)
-
-    # Top-left emboss kernel
+    # Top-left emboss kernel. The bottom-right kernel is its negation
     tl_kernel = np.array([[1,1,0],
                           [1,0,-1],
                           [0,-1,-1]])
 
-    # Top-right emboss kernel
+    # Top-right emboss kernel. The bottom-left kernel is its negation
     tr_kernel = np.array([[0,1,1],
                           [-1,0,1],
                           [-1,-1,0]])
 
-    # Bottom-left Emboss Kernel
-    bl_kernel = np.array([[0,-1,-1],
-                          [1,0,-1],
-                          [1, 1, 0]])
-
-    # Bottom-right Emboss Kernel
-    br_kernel = np.array([[-1,-1,0],
-                          [-1,0,1],
-                          [0, 1, 1]])
-
-    # PIL Emboss kernel - NOT BEING USED
-    pil_kernel = np.array([[-1,0,0],
-                      [0,1,0],
-                      [0,0,0]])
-
     # Convert the image to grayscale
-    grayscale = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    grayscale = pixel_format.convert(image, pixel_format.GRAY)
+
+    # Emboss with signed output so each response covers a kernel and its negation:
+    # max(tl, br) == |tl| and max(tr, bl) == |tr|
+    tl_emboss = cv2.filter2D(grayscale, cv2.CV_16S, tl_kernel)
+    tr_emboss = cv2.filter2D(grayscale, cv2.CV_16S, tr_kernel)
 
-    #Emboss each side of image with different kernels
-    tl_emboss = cv2.add(cv2.filter2D(grayscale, -1, tl_kernel), y)
-    tr_emboss = cv2.add(cv2.filter2D(grayscale, -1, tr_kernel), y)
-    bl_emboss = cv2.add(cv2.filter2D(grayscale, -1, bl_kernel), y)
-    br_emboss = cv2.add(cv2.filter2D(grayscale, -1, br_kernel), y)
+    # Combine all 4 embossed images together, reusing the first buffer
+    np.abs(tl_emboss, out=tl_emboss)
+    np.abs(tr_emboss, out=tr_emboss)
+    np.maximum(tl_emboss, tr_emboss, out=tl_emboss)
 
-    #Combine all 4 embossed images together
-    for i in range(height):
-        for j in range(width):
-            processed_image[i, j] = max(tl_emboss[i, j], tr_emboss[i, j], bl_emboss[i, j], br_emboss[i, j])
+    # Shift to mid gray and saturate to 0-255 in a single pass
+    processed_image = cv2.convertScaleAbs(tl_emboss, alpha=1, beta=128)
 
     return processed_image
 
 
 # Credit to Vardan Agarwal- https://medium.com/@vardanagarwal16
-def cartoon(image, type):
+@instrumentation.timed('filters.cartoon')
+def cartoon(image, type, sigma_s=64, sigma_r=0.25, canny_low=100, canny_high=200,
+            median_size=5, block_size=7, threshold_c=7, memoize=True):
 
-    height, width = image.shape[:2]
+    # Only compute the edge style that was asked for
+    if (type == 'thick'):
+        edges = cartoon_thick_edges(image, median_size, block_size, threshold_c)
+
+    elif (type == 'thin'):
+        edges = cartoon_thin_edges(image, canny_low, canny_high)
+
+    else:
+        return None
+
+    processed_image = cartoon_smooth(image, sigma_s, sigma_r, memoize)
+
+    return cv2.bitwise_and(processed_image, processed_image, mask=edges)
+
+
+@instrumentation.timed('filters.cartoon_thin_edges')
+def cartoon_thin_edges(image, canny_low=100, canny_high=200):
+    """ Thin edge style """
+
+    return cv2.bitwise_not(cv2.Canny(image, canny_low, canny_high))
+
+
+@instrumentation.timed('filters.cartoon_thick_edges')
+def cartoon_thick_edges(image, median_size=5, block_size=7, threshold_c=7):
+    """ Thick edge style """
 
     # Convert the image to grayscale
     grayscale = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-    grayscale = cv2.medianBlur(grayscale, 5)
+    grayscale = cv2.medianBlur(grayscale, median_size)
 
-    # Thin edge style
-    thin_edges = cv2.bitwise_not(cv2.Canny(image, 100, 200))
+    return cv2.adaptiveThreshold(grayscale, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block_size, threshold_c)
 
-    # Thick edge style
-    thick_edges = cv2.adaptiveThreshold(grayscale, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 7, 7)
 
-    processed_image = cv2.edgePreservingFilter(image, flags=2, sigma_s=64, sigma_r=0.25)
+@instrumentation.timed('filters.cartoon_smooth')
+def cartoon_smooth(image, sigma_s=64, sigma_r=0.25, memoize=True):
+    """ The edge preserving smoothing both cartoon styles share. This is by far the slowest stage,
+        so results are remembered per source image and reused when switching between styles.
+        memoize=False skips the memo, for images that won't be seen again (like video frames) """
 
-    thin_cartoon = cv2.bitwise_and(processed_image, processed_image, mask=thin_edges)
-    thick_cartoon = cv2.bitwise_and(processed_image, processed_image, mask=thick_edges)
+    if not memoize:
+        return cv2.edgePreservingFilter(image, flags=2, sigma_s=sigma_s, sigma_r=sigma_r)
 
-    if (type == 'thick'):
-        return thick_cartoon
+    key = smoothing_cache.make_key(image, 'cartoon_smooth', {'sigma_s': sigma_s, 'sigma_r': sigma_r})
 
-    if (type == 'thin'):
-        return thin_cartoon
+    processed_image = smoothing_cache.get(key)
+    if processed_image is None:
+        processed_image = cv2.edgePreservingFilter(image, flags=2, sigma_s=sigma_s, sigma_r=sigma_r)
 
+        # Only ever read, so the cache can keep this array instead of a copy
+        processed_image.flags.writeable = False
+        smoothing_cache.put(key, processed_image)
 
-# Credit to Michael Beyeler- https://www.askaswiss.com
-def sketch(image):
+    return processed_image
 
-    height, width = image.shape[:2]
-    processed_image = np.zeros((height, width), np.uint8)
+
+# Credit to Michael Beyeler- https://www.askaswiss.com
+@instrumentation.timed('filters.sketch')
+def sketch(image, blur_size=21):
 
     # Convert the image to grayscale
-    grayscale = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    grayscale = pixel_format.convert(image, pixel_format.GRAY)
 
     # Invert the grayscale image
     negative = cv2.bitwise_not(grayscale)
 
     # Blur the negative (this will be used as a mask)
-    negative = cv2.GaussianBlur(negative, ksize=(21, 21), sigmaX=0, sigmaY=0)
+    negative = cv2.GaussianBlur(negative, ksize=(blur_size, blur_size), sigmaX=0, sigmaY=0)
 
     # Blend grayscale with blurred negative
     processed_image = cv2.divide(grayscale, 255 - negative, scale=256) # This is a "dodge" blending technique
@@ -201,6 +250,7 @@ def sketch(image):
     return processed_image
 
 
+@instrumentation.timed('filters.invert')
 def invert(image):
 
     processed_image = cv2.bitwise_not(image)
@@ -208,6 +258,7 @@ def invert(image):
     return processed_image
 
 
+@instrumentation.timed('filters.surreal')
 def surreal(image):
 
     kernel = np.array([[0,-1,-1],
@@ -0,0 +1,127 @@
+"""
+File: image_loader.py
+Author: Adam Applegate
+Description: 
+
+    Opens images lazily. The dimensions are read from the file header, a
+    reduced size preview is decoded for display, and the full resolution
+    pixels are only decoded the first time something needs them
+   
+"""
+
+import threading
+
+import cv2
+from PIL import Image
+
+import instrumentation
+
+# File types the program opens as images
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Reduced decode modes, from most to least reduced. JPEGs are scaled while decoding,
+# which is much faster than decoding at full size and resizing afterwards
+REDUCED_MODES = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# EXIF orientations that rotate the image by 90 degrees, swapping width and height
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+EXIF_ORIENTATION = 0x0112
+
+
+def read_image_size(filepath):
+    """ Returns the (width, height) of an image as it will be displayed, reading only the file header """
+
+    with Image.open(filepath) as image:
+        width, height = image.size
+
+        # OpenCV applies the EXIF orientation when decoding, so match it
+        if image.getexif().get(EXIF_ORIENTATION) in ROTATED_ORIENTATIONS:
+            width, height = height, width
+
+    return width, height
+
+
+class LazyImage():
+    """ An image file that is decoded only as far as it's needed. Pixels are in OpenCV's BGR order """
+
+    def __init__(self, filepath, preview_width=1080, preview_height=720):
+        self.filepath = filepath
+
+        # Smallest size the preview should cover
+        self.preview_width = preview_width
+        self.preview_height = preview_height
+
+        self.width, self.height = read_image_size(filepath)
+
+        self._preview = None
+        self._full = None
+        self._lock = threading.Lock()
+
+
+    @property
+    def preview(self):
+        """ A version of the image at least as large as the preview size (or the full image, if smaller).
+            Uses the full resolution pixels if they have already been decoded """
+
+        with self._lock:
+            if self._full is not None:
+                return self._full
+
+            if self._preview is None:
+                self._preview = self.decode(self.reduced_mode())
+
+            return self._preview
+
+
+    @property
+    def full(self):
+        """ The full resolution image. Decoded the first time it's used """
+
+        with self._lock:
+            if self._full is None:
+                self._full = self.decode(cv2.IMREAD_COLOR)
+
+                # The preview isn't needed anymore
+                self._preview = None
+
+            return self._full
+
+
+    def is_fully_loaded(self):
+        return self._full is not None
+
+
+    def is_preview_loaded(self):
+        return self._preview is not None or self._full is not None
+
+
+    def memory_usage(self):
+        """ Returns the number of bytes of decoded pixels held in memory """
+
+        preview, full = self._preview, self._full
+
+        return (preview.nbytes if preview is not None else 0) + (full.nbytes if full is not None else 0)
+
+
+    def reduced_mode(self):
+        """ Picks the most reduced decode mode that still covers the preview size """
+
+        for factor, mode in REDUCED_MODES:
+            if self.width // factor >= self.preview_width or self.height // factor >= self.preview_height:
+                return mode
+
+        return cv2.IMREAD_COLOR
+
+
+    def decode(self, mode):
+        with instrumentation.span('image_loader.decode'):
+            image = cv2.imread(self.filepath, mode)
+
+        if image is None:
+            raise IOError(f'could not decode {self.filepath}')
+
+        return image
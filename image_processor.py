@@ -9,63 +9,113 @@ Description:
 
 import numpy as np
 import cv2
-import filters
+import filter_registry
+import instrumentation
+import pixel_format
+import tiling
+
+# Images with more pixels than this are filtered in tiles, when the filter allows it
+TILE_THRESHOLD = 16 * 1000 * 1000
+
+
+@instrumentation.timed('image_processor.make_proxy')
+def make_proxy(image, max_width, max_height):
+    """ Returns a copy of the image shrunk to fit within max_width x max_height, and the scale used.
+        Images that already fit are returned as they are, with a scale of 1.0 """
+
+    image_height, image_width = image.shape[:2]
+
+    scale = min(max_width / image_width, max_height / image_height, 1.0)
+    if scale == 1.0:
+        return image, scale
+
+    size = (max(1, int(image_width * scale)), max(1, int(image_height * scale)))
+    proxy = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+    return proxy, scale
+
 
 class ImageProcessor():
  
-    def __init__(self):
-       super.__init__
+    def __init__(self, cache=None, tile_threshold=TILE_THRESHOLD, memoize=True):
+        # Optional ResultCache that filter results are looked up in before being computed
+        self.cache = cache
+
+        # Pixel count above which tileable filters run tile by tile. None to never tile
+        self.tile_threshold = tile_threshold
 
+        # Whether filters that memoize an intermediate stage (like the cartoon smoothing) may do so.
+        # Off for images that are only filtered once, like video frames, and for benchmarks
+        self.memoize = memoize
 
 
-    def filter_image(self, filter, image=[]):
-        """ Applies a filter to an image """
+
+    @instrumentation.timed('image_processor.filter_image')
+    def filter_image(self, filter, image=[], proxy_scale=1.0, preview=False, **params):
+        """ Applies a filter to an image. Extra keyword arguments are passed on to the filter.
+            If image is a proxy resized by proxy_scale, size-based parameters are scaled to match.
+            preview=True lets the filter use faster, approximate settings """
 
         # If there is no image passed in, return empty array
         if len(image) == 0:
             return image
-        
-        processed_image = None
 
-        if (filter == 'Emboss'):
-            processed_image = filters.emboss(image)
-        
-        elif (filter == 'Cartoon-Thick'):
-            processed_image = filters.cartoon(image, 'thick')
-        
-        elif (filter == 'Cartoon-Thin'):
-            processed_image = filters.cartoon(image, 'thin')
+        # Unknown filters leave nothing to show
+        if not filter_registry.exists(filter):
+            return None
+
+        spec = filter_registry.get(filter)
 
-        elif (filter == 'Sketch'):
-            processed_image = filters.sketch(image)
+        if preview:
+            params = dict(spec.preview_params, **params)
 
-        elif (filter == 'Invert'):
-            print('inverting image')
-            processed_image = filters.invert(image)
+        params = spec.params_for_scale(params, proxy_scale)
 
-        elif (filter == 'Noisy'):
-            processed_image = filters.noisy(image)
+        if not self.memoize and 'memoize' in spec.params:
+            params = dict(params, memoize=False)
 
-        # elif (filter == 'Surreal'):
-        #     processed_image = filters.surreal(image)
+        # Only convert if the filter can't take the image's layout as it is
+        image = pixel_format.accept(image, spec.channels_in)
 
-        # elif (filter == 'Deep Fried'):
-        #     processed_image = filters.deep_fried(image)
+        # Results that change on every run can't be cached
+        if self.cache is None or not spec.is_deterministic(params):
+            return self.run_filter(spec, image, params)
 
-        else:
-            processed_image = self.current_media
-            return
+        with instrumentation.span('image_processor.cache_lookup'):
+            key = self.cache.make_key(image, filter, params, spec.version)
+            processed_image = self.cache.get(key)
+        if processed_image is None:
+            processed_image = self.run_filter(spec, image, params)
+
+            # Filters that changed nothing hand back the source image itself, which isn't worth caching
+            # Previews are redone at a new size or setting all the time, so they stay in memory only
+            if processed_image is not image:
+                self.cache.put(key, processed_image, disk=not preview)
 
-        # self.current_media = cv2.cvtColor(processed_image, cv2.COLOR_BGR2RGB)
         return processed_image
     
 
-    def filter_apply_scales(self, brightness, contrast, sharpness, image=[]):
+    def run_filter(self, spec, image, params):
+        """ Runs a filter, in tiles if the image is large enough and the result would be identical """
+
+        height, width = image.shape[:2]
+
+        if (self.tile_threshold is not None and height * width > self.tile_threshold
+                and spec.tileable and spec.is_deterministic(params)):
+            return tiling.filter_tiled(spec.name, image, **params)
+
+        return spec.apply(image, **params)
+
+
+    def filter_apply_scales(self, brightness, contrast, sharpness, image=[], proxy_scale=1.0, preview=False):
         """ Applies a brightness and contrast filter to an image """
     
-        processed_image = filters.brightness_contrast_sharpness(brightness, contrast, sharpness, image)
-
-        # self.current_media = cv2.cvtColor(processed_image, cv2.COLOR_BGR2RGB)
+        processed_image = self.filter_image('Scales', image, proxy_scale=proxy_scale, preview=preview,
+                                            brightness=brightness, contrast=contrast, sharpness=sharpness)
         return processed_image
 
-   
+
+    def make_proxy(self, image, max_width, max_height):
+        """ Returns a copy of the image shrunk to fit within max_width x max_height, and the scale used """
+
+        return make_proxy(image, max_width, max_height)
@@ -0,0 +1,238 @@
+"""
+File: instrumentation.py
+Author: Adam Applegate
+Description: 
+
+    Lightweight timing spans for finding out where processing time goes.
+    Spans are aggregated into per-name counters and histograms, and can
+    optionally be recorded to a trace file that opens in chrome://tracing
+    or Perfetto. While disabled, a span costs a single flag check
+
+    Enable with the FILTER_FREE_PROFILE=1 environment variable (add
+    FILTER_FREE_TRACE=path/to/trace.json to also record a trace), or by
+    calling enable()
+   
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+
+# Histogram buckets are powers of two, in microseconds: <1us, <2us, <4us ... up to about 1 hour
+HISTOGRAM_BUCKETS = 32
+
+# Stop recording trace events past this many, so a long session can't use unbounded memory
+MAX_TRACE_EVENTS = 1000000
+
+enabled = False
+recording_trace = False
+
+_lock = threading.Lock()
+_stats = {}
+_trace = []
+_start = time.perf_counter()
+
+
+class SpanStats():
+    """ Aggregated timings for every span with the same name """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+
+
+    def add(self, seconds):
+        self.count = self.count + 1
+        self.total = self.total + seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+        bucket = min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)
+        self.histogram[bucket] = self.histogram[bucket] + 1
+
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0.0
+
+
+    def percentile(self, fraction):
+        """ Estimates a percentile from the histogram, as the upper edge of its bucket, in seconds """
+
+        target = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen = seen + count
+            if seen >= target and count > 0:
+                return min((1 << bucket) / 1e6, self.max)
+
+        return self.max
+
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.mean(),
+            'min': self.min if self.count > 0 else 0.0,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'histogram_us_log2': self.histogram,
+        }
+
+
+class Span():
+    """ Times a block of code. Use through span() """
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        record(self.name, self.start, time.perf_counter())
+        return False
+
+
+class NullSpan():
+    """ Stands in for a Span while instrumentation is disabled """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name):
+    """ Returns a context manager that times the block it wraps under name """
+
+    if not enabled:
+        return NULL_SPAN
+
+    return Span(name)
+
+
+def timed(name):
+    """ Decorator that times every call of a function under name """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, start, time.perf_counter())
+
+        return wrapper
+
+    return decorator
+
+
+def record(name, start, end):
+    """ Adds a finished span to the statistics, and to the trace if one is being recorded """
+
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = SpanStats(name)
+
+        stats.add(end - start)
+
+        if recording_trace and len(_trace) < MAX_TRACE_EVENTS:
+            _trace.append((name, start, end, threading.get_ident()))
+
+
+def enable(trace=False):
+    """ Starts collecting spans. With trace=True every span is also kept for write_trace() """
+
+    global enabled, recording_trace
+
+    recording_trace = trace
+    enabled = True
+
+
+def disable():
+    """ Stops collecting spans. Collected statistics are kept until reset() """
+
+    global enabled, recording_trace
+
+    enabled = False
+    recording_trace = False
+
+
+def reset():
+    """ Throws away every collected statistic and trace event """
+
+    with _lock:
+        _stats.clear()
+        del _trace[:]
+
+
+def get_stats():
+    """ Returns the statistics for every span name, as plain dictionaries """
+
+    with _lock:
+        return {name: stats.to_dict() for name, stats in _stats.items()}
+
+
+def summary(limit=None):
+    """ Returns a human readable table of the spans, slowest total first """
+
+    with _lock:
+        rows = sorted(_stats.values(), key=lambda stats: stats.total, reverse=True)
+
+    if limit is not None:
+        rows = rows[:limit]
+
+    lines = [f'{"span":36} {"count":>7} {"total ms":>10} {"mean ms":>9} {"p95 ms":>9} {"max ms":>9}']
+    for stats in rows:
+        lines.append(f'{stats.name:36} {stats.count:7} {stats.total * 1000:10.1f} {stats.mean() * 1000:9.2f} '
+                     f'{stats.percentile(0.95) * 1000:9.2f} {stats.max * 1000:9.2f}')
+
+    return '\n'.join(lines)
+
+
+def write_trace(path):
+    """ Writes the recorded spans as a Chrome trace event file """
+
+    with _lock:
+        events = [{
+            'name': name,
+            'ph': 'X',
+            'ts': (start - _start) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': thread,
+        } for name, start, end, thread in _trace]
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump({'traceEvents': events}, file)
+
+
+# Turn on from the environment, so any entry point can be profiled without code changes
+if os.environ.get('FILTER_FREE_PROFILE') or os.environ.get('FILTER_FREE_TRACE'):
+    enable(trace=bool(os.environ.get('FILTER_FREE_TRACE')))
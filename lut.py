@@ -0,0 +1,95 @@
+"""
+File: lut.py
+Author: Adam Applegate
+Description: 
+
+    Builds and caches 256-entry lookup tables for per-value adjustments,
+    so any stack of them can be applied to an image in a single pass
+   
+"""
+
+from functools import lru_cache
+
+import numpy as np
+import cv2
+
+# How many tables to keep before the least recently used ones are evicted
+LUT_CACHE_SIZE = 256
+
+# Every possible uint8 value, used as the input when building a table
+RAMP = np.arange(256, dtype=np.uint8)
+
+
+@lru_cache(maxsize=LUT_CACHE_SIZE)
+def brightness_contrast_table(brightness, contrast):
+    """ Returns a table that applies brightness and then contrast.
+        Each step is run on the ramp with the same cv2 call the full image used to get,
+        so the table gives identical results """
+
+    table = RAMP
+
+    if brightness != 0:
+        if brightness > 0:
+            shadow = brightness
+            highlight = 255
+        else:
+            shadow = 0
+            highlight = 255 + brightness
+        alpha_b = (highlight - shadow)/255
+        gamma_b = shadow
+
+        table = cv2.addWeighted(table, alpha_b, table, 0, gamma_b)
+
+    if contrast != 0:
+        f = 131*(contrast + 127)/(127*(131-contrast))
+        alpha_c = f
+        gamma_c = 127*(1-f)
+
+        table = cv2.addWeighted(table, alpha_c, table, 0, gamma_c)
+
+    return _freeze(table)
+
+
+@lru_cache(maxsize=LUT_CACHE_SIZE)
+def saturation_value_table(saturation=1.25, value=1.25):
+    """ Returns a 3 channel table for HSV images that scales the saturation and value channels.
+        Hue is left untouched """
+
+    table = np.empty((256, 3), dtype=np.uint8)
+
+    table[:, 0] = RAMP
+    table[:, 1] = np.minimum(RAMP * saturation, 255)
+    table[:, 2] = np.minimum(RAMP * value, 255)
+
+    return _freeze(table.reshape(1, 256, 3))
+
+
+def apply_table(image, table):
+    """ Applies a lookup table to every pixel of an image """
+
+    return cv2.LUT(image, table)
+
+
+def cache_info():
+    """ Returns the hit/miss statistics of each table cache """
+
+    return {
+        'brightness_contrast': brightness_contrast_table.cache_info(),
+        'saturation_value': saturation_value_table.cache_info(),
+    }
+
+
+def clear_cache():
+    """ Empties every table cache """
+
+    brightness_contrast_table.cache_clear()
+    saturation_value_table.cache_clear()
+
+
+def _freeze(table):
+    """ Cached tables are shared between callers, so make them read-only """
+
+    table = np.ascontiguousarray(table)
+    table.flags.writeable = False
+
+    return table
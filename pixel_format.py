@@ -0,0 +1,92 @@
+"""
+File: pixel_format.py
+Author: Adam Applegate
+Description: 
+
+    Defines the program's in-memory pixel format. Images are kept as uint8
+    numpy arrays in OpenCV's native channel order (BGR, or single channel
+    GRAY), which is what cv2.imread, cv2.VideoCapture, cv2.imwrite and
+    cv2.VideoWriter all use. Conversions only happen at the boundaries that
+    truly need another layout: Tkinter display (RGB), and filters that
+    declare they can't take the layout they're given
+   
+"""
+
+import cv2
+
+import instrumentation
+
+# Channel layouts
+GRAY = 'GRAY'
+BGR = 'BGR'
+BGRA = 'BGRA'
+RGB = 'RGB'
+RGBA = 'RGBA'
+
+# The layout every image is stored in, unless it only has one channel
+CANONICAL = BGR
+
+# cv2.cvtColor codes between layouts
+CONVERSIONS = {
+    (GRAY, BGR): cv2.COLOR_GRAY2BGR,
+    (GRAY, BGRA): cv2.COLOR_GRAY2BGRA,
+    (GRAY, RGB): cv2.COLOR_GRAY2RGB,
+    (GRAY, RGBA): cv2.COLOR_GRAY2RGBA,
+    (BGR, GRAY): cv2.COLOR_BGR2GRAY,
+    (BGR, BGRA): cv2.COLOR_BGR2BGRA,
+    (BGR, RGB): cv2.COLOR_BGR2RGB,
+    (BGR, RGBA): cv2.COLOR_BGR2RGBA,
+    (BGRA, GRAY): cv2.COLOR_BGRA2GRAY,
+    (BGRA, BGR): cv2.COLOR_BGRA2BGR,
+    (BGRA, RGB): cv2.COLOR_BGRA2RGB,
+    (BGRA, RGBA): cv2.COLOR_BGRA2RGBA,
+}
+
+
+def layout_of(image):
+    """ Returns the layout of an image stored in the canonical format """
+
+    if image.ndim == 2 or image.shape[2] == 1:
+        return GRAY
+
+    if image.shape[2] == 4:
+        return BGRA
+
+    return BGR
+
+
+def convert(image, layout, source=None):
+    """ Converts an image to a layout. Returns the image itself, without copying, if it's already in it """
+
+    source = source or layout_of(image)
+    if source == layout:
+        return image
+
+    with instrumentation.span(f'pixel_format.{source}_to_{layout}'):
+        return cv2.cvtColor(image, CONVERSIONS[(source, layout)])
+
+
+def accept(image, layouts):
+    """ Returns the image in one of the given layouts, converting only if it isn't in any of them already.
+        layouts=None accepts anything """
+
+    if layouts is None or layout_of(image) in layouts:
+        return image
+
+    return convert(image, layouts[0])
+
+
+def for_display(image):
+    """ Returns an image Tkinter/PIL can display. Grayscale images are displayed as they are """
+
+    layout = layout_of(image)
+    if layout == GRAY:
+        return image
+
+    return convert(image, RGBA if layout == BGRA else RGB, layout)
+
+
+def for_video(image):
+    """ Returns an image cv2.VideoWriter can encode, which needs 3 channels """
+
+    return convert(image, BGR)
@@ -0,0 +1,204 @@
+"""
+File: prefetch.py
+Author: Adam Applegate
+Description:
+
+    Steps through the images in a folder. While one image is shown, its
+    neighbours are opened and their display sized previews decoded on
+    background threads, so moving to the next or previous image doesn't wait
+    on the disk. Full resolution pixels are still only decoded when they're
+    needed. Decoded images are kept within a memory budget, dropping the ones
+    furthest from the current image first
+
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
+from image_loader import IMAGE_EXTENSIONS, LazyImage
+
+# How many images either side of the current one are decoded ahead
+PREFETCH_RADIUS = 3
+
+# Default limit for the decoded images kept in memory (256 MB)
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+
+def list_images(folder):
+    """ Returns the paths of the images in a folder (not its subfolders), sorted by name """
+
+    try:
+        files = os.listdir(folder)
+    except OSError:
+        return []
+
+    paths = [os.path.join(folder, file) for file in files if file.lower().endswith(IMAGE_EXTENSIONS)]
+
+    return sorted((path for path in paths if os.path.isfile(path)), key=lambda path: os.path.basename(path).lower())
+
+
+class FolderPrefetcher():
+    """ A cursor over the images in one folder, with the neighbours of the cursor decoded ahead """
+
+    def __init__(self, folder, preview_width=1080, preview_height=720, radius=PREFETCH_RADIUS,
+                 memory_budget=DEFAULT_MEMORY_BUDGET, workers=2):
+        self.folder = folder
+
+        self.preview_width = preview_width
+        self.preview_height = preview_height
+
+        self.radius = radius
+        self.memory_budget = memory_budget
+
+        self.paths = list_images(folder)
+        self.index = None
+
+        # Opened images, {path: LazyImage}, and the decodes still waiting to run, {path: future}
+        self.images = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='filter_free_prefetch')
+
+
+    def __len__(self):
+        return len(self.paths)
+
+
+    def open(self, filepath):
+        """ Moves the cursor to an image and returns it as a LazyImage. Starts decoding its neighbours """
+
+        filepath = os.path.join(self.folder, os.path.basename(filepath))
+
+        # The file may have been added since the folder was listed
+        if filepath not in self.paths:
+            self.paths = list_images(self.folder)
+
+        if filepath in self.paths:
+            self.index = self.paths.index(filepath)
+
+        image = self.get(filepath)
+
+        self.prefetch()
+
+        return image
+
+
+    def neighbour(self, step):
+        """ Returns the path step images away from the cursor, or None past either end of the folder """
+
+        if self.index is None:
+            return None
+
+        index = self.index + step
+        if index < 0 or index >= len(self.paths):
+            return None
+
+        return self.paths[index]
+
+
+    def get(self, filepath):
+        """ Returns the LazyImage for a path, opening it if it isn't open already """
+
+        with self.lock:
+            image = self.images.get(filepath)
+
+        if image is None:
+            image = LazyImage(filepath, self.preview_width, self.preview_height)
+
+            with self.lock:
+                image = self.images.setdefault(filepath, image)
+
+        return image
+
+
+    def prefetch(self):
+        """ Queues preview decodes for the images around the cursor, nearest first.
+            Decodes that haven't started and are no longer near the cursor are dropped """
+
+        window = []
+        for distance in range(1, self.radius + 1):
+            for step in (distance, -distance):
+                path = self.neighbour(step)
+                if path is not None:
+                    window.append(path)
+
+        with self.lock:
+            for path in list(self.pending):
+                if path not in window and self.pending[path].cancel():
+                    del self.pending[path]
+
+            for path in window:
+                image = self.images.get(path)
+                if path in self.pending or (image is not None and image.is_preview_loaded()):
+                    continue
+
+                self.pending[path] = self.executor.submit(self.decode_preview, path)
+
+
+    def decode_preview(self, filepath):
+        """ Runs on a worker thread. Opens an image and decodes its preview """
+
+        try:
+            with instrumentation.span('prefetch.decode'):
+                self.get(filepath).preview
+
+        # A file that can't be read is reported when the user actually opens it
+        except Exception as error:
+            with self.lock:
+                self.images.pop(filepath, None)
+
+            print(f'Could not prefetch {filepath}: {error}')
+
+        finally:
+            with self.lock:
+                self.pending.pop(filepath, None)
+
+        self.enforce_budget()
+
+
+    def get_memory_usage(self):
+        """ Returns the number of bytes of decoded pixels held by the opened images """
+
+        with self.lock:
+            return sum(image.memory_usage() for image in self.images.values())
+
+
+    def distance(self, filepath):
+        """ How many images a path is from the cursor. Paths no longer in the folder are the furthest away """
+
+        if self.index is None or filepath not in self.paths:
+            return len(self.paths) + 1
+
+        return abs(self.paths.index(filepath) - self.index)
+
+
+    def enforce_budget(self):
+        """ Drops opened images, furthest from the cursor first, until memory use is within budget.
+            The image under the cursor is always kept """
+
+        with self.lock:
+            usage = sum(image.memory_usage() for image in self.images.values())
+            if usage <= self.memory_budget:
+                return
+
+            for path in sorted(self.images, key=self.distance, reverse=True):
+                if usage <= self.memory_budget or self.distance(path) == 0:
+                    break
+
+                usage = usage - self.images.pop(path).memory_usage()
+
+
+    def shutdown(self):
+        """ Drops the pending decodes and every opened image """
+
+        with self.lock:
+            for future in self.pending.values():
+                future.cancel()
+
+            self.pending = {}
+            self.images = {}
+
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,274 @@
+"""
+File: result_cache.py
+Author: Adam Applegate
+Description: 
+
+    Caches filtered images, keyed by a hash of the source image plus the
+    filter name and parameters. Memory use is capped by evicting the least
+    recently used results, and an optional disk tier survives restarts
+   
+"""
+
+import hashlib
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+# Default limit for the results kept in memory (512 MB)
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Default limit for the results kept on disk (2 GB)
+DEFAULT_MAX_DISK_BYTES = 2 * 1024 * 1024 * 1024
+
+# Part of every key. Bump when the key or file format changes, so old disk results are never read
+CACHE_VERSION = 1
+
+
+def hash_image(image):
+    """ Returns a short hex digest of an image's pixels, shape and type """
+
+    image = np.ascontiguousarray(image)
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{image.shape}{image.dtype}'.encode())
+    digest.update(image.data)
+
+    return digest.hexdigest()
+
+
+def file_key(filepath):
+    """ Returns a short hex digest identifying a file's contents well enough to reuse work done on it.
+        Changes when the file is written. A file that can't be read is identified by its path alone """
+
+    try:
+        stat = os.stat(filepath)
+        identity = f'{os.path.abspath(filepath)}:{stat.st_mtime_ns}:{stat.st_size}'
+    except OSError:
+        identity = os.path.abspath(filepath)
+
+    return hashlib.blake2b(identity.encode(), digest_size=16).hexdigest()
+
+
+class ResultCache():
+    """ A memory-bounded LRU cache of filter results, with an optional on-disk tier """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, disk_dir=None, max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        # Results in least to most recently used order
+        self.entries = OrderedDict()
+        self.bytes_used = 0
+
+        # Files in the disk tier, {path: size}, least to most recently used. Read from the
+        # directory once, then kept up to date as results are saved, loaded and trimmed
+        self.disk_files = None
+        self.disk_bytes_used = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        # Hashing a large image isn't free, so remember the hash of the last source image
+        self._last_source = None
+        self._last_source_hash = None
+
+        # Filters may run on worker threads, so every lookup and update holds this lock
+        self.lock = threading.RLock()
+
+
+    def make_key(self, image, filter, params, version=1):
+        """ Builds the cache key for running a filter with some parameters on an image.
+            version is the filter's own version, bumped when its output changes """
+
+        param_text = ','.join(f'{name}={params[name]!r}' for name in sorted(params))
+
+        return f'v{CACHE_VERSION}:{self.source_hash(image)}:{filter}@{version}:{param_text}'
+
+
+    def source_hash(self, image):
+        """ Returns the hash of an image, reusing the last one if it's the same array """
+
+        with self.lock:
+            if self._last_source is not None and self._last_source() is image:
+                return self._last_source_hash
+
+        image_hash = hash_image(image)
+
+        with self.lock:
+            try:
+                self._last_source = weakref.ref(image)
+                self._last_source_hash = image_hash
+            except TypeError:
+                self._last_source = None
+
+        return image_hash
+
+
+    def get(self, key):
+        """ Returns the cached result for a key, or None.
+            Results are shared between callers, so they're read-only. Copy one before changing it """
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits = self.hits + 1
+                return self.entries[key]
+
+            result = self.load_from_disk(key)
+            if result is not None:
+                self.disk_hits = self.disk_hits + 1
+                self.add(key, result)
+                return result
+
+            self.misses = self.misses + 1
+            return None
+
+
+    def put(self, key, result, disk=True):
+        """ Stores a result in memory, and on disk if the disk tier is enabled and disk is True.
+            Short lived results, like previews, aren't worth the disk write """
+
+        if result is None:
+            return
+
+        # Results bigger than the whole memory tier would only be copied to be thrown away
+        in_memory = result.nbytes <= self.max_bytes
+
+        # Cached results are shared between callers, so they must not be changed in place.
+        # The caller keeps its own array writeable, and the cache freezes a copy
+        if in_memory and result.flags.writeable:
+            result = result.copy()
+            result.flags.writeable = False
+
+        with self.lock:
+            if in_memory:
+                self.add(key, result)
+
+            if disk:
+                self.save_to_disk(key, result)
+
+
+    def add(self, key, result):
+        # Results bigger than the whole cache aren't worth keeping
+        if result.nbytes > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self.bytes_used = self.bytes_used - self.entries.pop(key).nbytes
+
+        self.entries[key] = result
+        self.bytes_used = self.bytes_used + result.nbytes
+
+        # Evict the least recently used results until within the limit
+        while self.bytes_used > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes_used = self.bytes_used - evicted.nbytes
+
+
+    def clear(self):
+        """ Removes every result from memory. The disk tier is left alone """
+
+        with self.lock:
+            self.entries.clear()
+            self.bytes_used = 0
+
+
+    def stats(self):
+        """ Returns the cache's hit/miss counters and memory use """
+
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'bytes': self.bytes_used,
+            }
+
+
+    def disk_path(self, key):
+        name = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+        return os.path.join(self.disk_dir, name + '.npy')
+
+
+    def load_from_disk(self, key):
+        if self.disk_dir is None:
+            return None
+
+        path = self.disk_path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            result = np.load(path)
+        except (OSError, ValueError):
+            return None
+
+        # Mark the file as recently used, so it isn't the first to be evicted
+        os.utime(path)
+        if path in self.list_disk():
+            self.disk_files.move_to_end(path)
+
+        result.flags.writeable = False
+        return result
+
+
+    def save_to_disk(self, key, result):
+        if self.disk_dir is None:
+            return
+
+        os.makedirs(self.disk_dir, exist_ok=True)
+
+        # Write to a temp name first, so a crash never leaves a half written result behind
+        path = self.disk_path(key)
+        temp_path = path + '.part'
+        with open(temp_path, 'wb') as file:
+            np.save(file, result)
+            size = file.tell()
+        os.replace(temp_path, path)
+
+        files = self.list_disk()
+        self.disk_bytes_used = self.disk_bytes_used - files.pop(path, 0) + size
+        files[path] = size
+
+        self.trim_disk()
+
+
+    def list_disk(self):
+        """ Returns the disk tier's {path: size}, least recently used first. The directory is only
+            scanned the first time, and the listing is kept up to date after that """
+
+        if self.disk_files is None:
+            files = []
+            if os.path.isdir(self.disk_dir):
+                for name in os.listdir(self.disk_dir):
+                    if name.endswith('.npy'):
+                        path = os.path.join(self.disk_dir, name)
+                        stat = os.stat(path)
+                        files.append((stat.st_mtime, path, stat.st_size))
+
+            self.disk_files = OrderedDict((path, size) for _, path, size in sorted(files))
+            self.disk_bytes_used = sum(self.disk_files.values())
+
+        return self.disk_files
+
+
+    def trim_disk(self):
+        """ Deletes the least recently used results on disk until within max_disk_bytes """
+
+        files = self.list_disk()
+
+        while self.disk_bytes_used > self.max_disk_bytes and len(files) > 0:
+            path, size = files.popitem(last=False)
+            self.disk_bytes_used = self.disk_bytes_used - size
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
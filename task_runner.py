@@ -0,0 +1,161 @@
+"""
+File: task_runner.py
+Author: Adam Applegate
+Description: 
+
+    Runs slow work (like filtering) on worker threads and hands the results
+    back to the Tk main thread. Each task belongs to a channel, and starting
+    a new task on a channel supersedes the old one, so stale results are
+    never delivered
+   
+"""
+
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# How often the main thread checks for finished tasks, in milliseconds
+POLL_INTERVAL = 15
+
+# How often progress is reported for a running task, in seconds
+PROGRESS_INTERVAL = 0.1
+
+
+class Task():
+    """ A unit of work submitted to the TaskRunner """
+
+    def __init__(self, channel, generation, description, on_done, on_error, supersede=True):
+        self.channel = channel
+        self.generation = generation
+
+        # Where the task is kept while it runs. Tasks that supersede share their channel's slot,
+        # the others get one of their own
+        self.key = channel if supersede else (channel, generation)
+        self.description = description
+        self.on_done = on_done
+        self.on_error = on_error
+
+        self.future = None
+        self.start_time = time.perf_counter()
+
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+
+class TaskRunner():
+    """ Runs functions on a thread pool and calls back on the Tk main thread """
+
+    def __init__(self, widget, max_workers=2, on_progress=None):
+        # Any Tk widget, used for its after() scheduler
+        self.widget = widget
+
+        # on_progress(description, elapsed) is called periodically while the newest task on a channel runs
+        self.on_progress = on_progress
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='filter_free_worker')
+
+        # The newest task on each channel, plus every running task that can't be superseded.
+        # Anything else is stale
+        self.current = {}
+        self.generation = 0
+
+        # Finished tasks waiting to be handed to the main thread
+        self.finished = queue.Queue()
+
+        self.polling = False
+        self.last_progress = 0.0
+
+
+    def submit(self, channel, function, *args, description='', on_done=None, on_error=None, supersede=True, **kwargs):
+        """ Runs function(*args, **kwargs) on a worker thread.
+            on_done(result) or on_error(error) is called on the main thread, but only if no newer
+            task was submitted on the same channel in the meantime.
+            With supersede=False the task neither cancels nor is cancelled by other tasks on the
+            channel, and its result is always delivered. Use it for work that must finish, like saving """
+
+        # Supersede the previous task. If it hasn't started yet it never will
+        if supersede:
+            self.cancel(channel)
+
+        self.generation = self.generation + 1
+        task = Task(channel, self.generation, description, on_done, on_error, supersede)
+        self.current[task.key] = task
+
+        task.future = self.executor.submit(function, *args, **kwargs)
+        task.future.add_done_callback(lambda future: self.finished.put(task))
+
+        if not self.polling:
+            self.polling = True
+            self.widget.after(POLL_INTERVAL, self.poll)
+
+        return task
+
+
+    def cancel(self, channel):
+        """ Cancels the newest task on a channel. A task that is already running finishes, but its result is dropped """
+
+        task = self.current.pop(channel, None)
+        if task is not None:
+            task.future.cancel()
+
+
+    def is_current(self, task):
+        return self.current.get(task.key) is task
+
+
+    def busy(self, channel=None):
+        """ Returns True if a task is still running on the channel (or any channel) """
+
+        if channel is None:
+            return len(self.current) > 0
+
+        return any(task.channel == channel for task in self.current.values())
+
+
+    def poll(self):
+        """ Runs on the main thread. Delivers finished tasks and reports progress """
+
+        while True:
+            try:
+                task = self.finished.get_nowait()
+            except queue.Empty:
+                break
+
+            # Stale or cancelled
+            if not self.is_current(task) or task.future.cancelled():
+                continue
+
+            del self.current[task.key]
+
+            error = task.future.exception()
+            if error is None:
+                if task.on_done is not None:
+                    task.on_done(task.future.result())
+
+            elif task.on_error is not None:
+                task.on_error(error)
+
+            else:
+                raise error
+
+        now = time.perf_counter()
+        if self.on_progress is not None and now - self.last_progress >= PROGRESS_INTERVAL:
+            self.last_progress = now
+            for task in self.current.values():
+                if task.description:
+                    self.on_progress(task.description, task.elapsed())
+
+        if len(self.current) > 0:
+            self.widget.after(POLL_INTERVAL, self.poll)
+        else:
+            self.polling = False
+
+
+    def shutdown(self):
+        """ Drops every pending task and stops the worker threads """
+
+        for channel in list(self.current):
+            self.cancel(channel)
+
+        self.executor.shutdown(wait=False)
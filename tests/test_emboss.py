@@ -0,0 +1,81 @@
+"""
+File: tests/test_emboss.py
+Author: Adam Applegate
+Description:
+
+    Checks that the vectorized emboss filter gives exactly the same output
+    as the original per-pixel implementation, on every image in media/
+
+"""
+
+import glob
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import filters
+
+MEDIA = sorted(glob.glob(os.path.join(ROOT, 'media', '*')))
+
+
+def reference_emboss(image):
+    """ The original emboss: four kernels on the grayscale image, each shifted to mid gray with
+        saturation, then combined with a per-pixel max """
+
+    height, width = image.shape[:2]
+
+    # Create an array the same size as the image, but it's gray
+    y = np.ones((height, width), np.uint8) * 128
+
+    # The final image will be stored here
+    processed_image = np.zeros((height, width), np.uint8)
+
+    tl_kernel = np.array([[1,1,0],
+                          [1,0,-1],
+                          [0,-1,-1]])
+
+    tr_kernel = np.array([[0,1,1],
+                          [-1,0,1],
+                          [-1,-1,0]])
+
+    bl_kernel = np.array([[0,-1,-1],
+                          [1,0,-1],
+                          [1, 1, 0]])
+
+    br_kernel = np.array([[-1,-1,0],
+                          [-1,0,1],
+                          [0, 1, 1]])
+
+    grayscale = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    tl_emboss = cv2.add(cv2.filter2D(grayscale, -1, tl_kernel), y)
+    tr_emboss = cv2.add(cv2.filter2D(grayscale, -1, tr_kernel), y)
+    bl_emboss = cv2.add(cv2.filter2D(grayscale, -1, bl_kernel), y)
+    br_emboss = cv2.add(cv2.filter2D(grayscale, -1, br_kernel), y)
+
+    # Combine all 4 embossed images together. Rows are read as lists, which keeps the
+    # per-pixel loop fast enough to run on every media image
+    for i in range(height):
+        tl_row, tr_row, bl_row, br_row = tl_emboss[i].tolist(), tr_emboss[i].tolist(), bl_emboss[i].tolist(), br_emboss[i].tolist()
+        processed_image[i] = [max(tl, tr, bl, br) for tl, tr, bl, br in zip(tl_row, tr_row, bl_row, br_row)]
+
+    return processed_image
+
+
+@pytest.mark.parametrize('path', MEDIA, ids=os.path.basename)
+def test_emboss_matches_reference(path):
+    image = cv2.imread(path)
+
+    assert np.array_equal(filters.emboss(image), reference_emboss(image))
+
+
+def test_emboss_matches_reference_on_random_input():
+    image = np.random.default_rng(0).integers(0, 256, (97, 131, 3), np.uint8)
+
+    assert np.array_equal(filters.emboss(image), reference_emboss(image))
@@ -0,0 +1,92 @@
+"""
+File: tests/test_tiling.py
+Author: Adam Applegate
+Description:
+
+    Checks that filtering in tiles gives exactly the same result as filtering
+    the whole image, both through tiling.filter_tiled and through
+    ImageProcessor once an image is over its tile threshold
+
+"""
+
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import filter_registry
+import tiling
+from image_processor import ImageProcessor
+
+TILEABLE = [spec.name for spec in filter_registry.specs(menu_only=False) if spec.tileable]
+
+
+def make_image(shape=(300, 500, 3)):
+    """ Random noise over a smooth gradient, so both flat areas and edges cross the tile borders """
+
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, shape[1], dtype=np.float32)[np.newaxis, :, np.newaxis]
+
+    return np.clip(gradient + rng.normal(0, 40, shape), 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize('name', TILEABLE)
+@pytest.mark.parametrize('tile_size', [64, 100])
+def test_filter_tiled_matches_whole_image(name, tile_size):
+    image = make_image()
+    spec = filter_registry.get(name)
+
+    np.testing.assert_array_equal(tiling.filter_tiled(name, image, tile_size=tile_size), spec.apply(image))
+
+
+def test_filter_tiled_params_change_the_halo():
+    image = make_image()
+    spec = filter_registry.get('Sketch')
+
+    np.testing.assert_array_equal(tiling.filter_tiled('Sketch', image, tile_size=64, blur_size=51),
+                                  spec.apply(image, blur_size=51))
+
+
+def test_filter_tiled_single_thread():
+    image = make_image()
+    threads = cv2.getNumThreads()
+
+    cv2.setNumThreads(1)
+    try:
+        result = tiling.filter_tiled('Emboss', image, tile_size=64)
+    finally:
+        cv2.setNumThreads(threads)
+
+    np.testing.assert_array_equal(result, filter_registry.get('Emboss').apply(image))
+
+
+def test_filter_tiled_output_path(tmp_path):
+    image = make_image()
+    output_path = str(tmp_path / 'tiled.npy')
+
+    tiling.filter_tiled('Invert', image, tile_size=64, output_path=output_path)
+
+    np.testing.assert_array_equal(np.load(output_path), filter_registry.get('Invert').apply(image))
+
+
+def test_filter_tiled_rejects_untileable():
+    with pytest.raises(ValueError):
+        tiling.filter_tiled('Noisy', make_image())
+
+
+@pytest.mark.parametrize('name', filter_registry.names())
+def test_image_processor_tiled_matches_untiled(name):
+    image = make_image()
+
+    # Noisy is only reproducible with a seed
+    params = {'seed': 1} if 'seed' in filter_registry.get(name).params else {}
+
+    tiled = ImageProcessor(tile_threshold=1000, memoize=False).filter_image(name, image, **params)
+    untiled = ImageProcessor(tile_threshold=None, memoize=False).filter_image(name, image, **params)
+
+    np.testing.assert_array_equal(tiled, untiled)
@@ -0,0 +1,193 @@
+"""
+File: tests/test_undo_redo.py
+Author: Adam Applegate
+Description:
+
+    Checks undo/redo round trips, multi-step jumps and invalid step counts
+    for both the image based UndoRedoManager and the command based CommandHistory
+
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from undo_redo_manager import CommandHistory, EmptyCommandStackError, UndoRedoManager
+
+
+def make_images(count, shape=(40, 60, 3)):
+    rng = np.random.default_rng(0)
+
+    return [rng.integers(0, 256, shape, np.uint8) for _ in range(count)]
+
+
+def make_history(checkpoint_interval=3):
+    """ A history of alternating filters on a random image, and the image after each command """
+
+    image = make_images(1)[0]
+    history = CommandHistory(image, checkpoint_interval=checkpoint_interval)
+
+    states = [image]
+    for index in range(7):
+        if index % 2 == 0:
+            states.append(history.apply_filter('Invert'))
+        else:
+            states.append(history.apply_scales(10 * index, 5, 0))
+
+    return history, states
+
+
+def test_manager_round_trip():
+    manager = UndoRedoManager()
+    images = make_images(20)
+
+    for image in images:
+        manager.push_undo_stack(image)
+
+    # Undo moves each image to the redo stack, redo moves it back
+    for index in range(19, 0, -1):
+        assert np.array_equal(manager.undo(), images[index])
+
+    for index in range(1, 20):
+        assert np.array_equal(manager.redo(), images[index])
+
+    assert manager.get_undo_size() == 20
+    assert manager.get_redo_size() == 0
+
+
+def test_manager_images_are_writeable():
+    manager = UndoRedoManager()
+    images = make_images(12)
+
+    for image in images:
+        manager.push_undo_stack(image)
+
+    # Both whole images and images rebuilt from deltas
+    for _ in range(11):
+        assert manager.undo().flags.writeable
+
+    for _ in range(11):
+        assert manager.redo().flags.writeable
+
+
+def test_manager_n_steps():
+    manager = UndoRedoManager()
+    images = make_images(12)
+
+    for image in images:
+        manager.push_undo_stack(image)
+
+    assert np.array_equal(manager.undo(5), images[7])
+    assert manager.get_undo_size() == 7
+    assert manager.get_redo_size() == 5
+
+    assert np.array_equal(manager.redo(3), images[9])
+    assert manager.get_undo_size() == 10
+    assert manager.get_redo_size() == 2
+
+
+def test_manager_spilled_round_trip():
+    # A tiny budget spills nearly every image to disk
+    manager = UndoRedoManager(memory_budget=1)
+    images = make_images(10)
+
+    for image in images:
+        manager.push_undo_stack(image)
+
+    for _ in range(5):
+        manager.undo(3)
+        manager.redo(3)
+
+    for index in range(9, -1, -1):
+        assert np.array_equal(manager.pop_undo_stack(), images[index])
+
+    assert manager.get_disk_usage() == 0
+
+
+@pytest.mark.parametrize('n', [0, -1])
+def test_manager_rejects_invalid_n(n):
+    manager = UndoRedoManager()
+    for image in make_images(3):
+        manager.push_undo_stack(image)
+
+    with pytest.raises(ValueError):
+        manager.undo(n)
+    with pytest.raises(ValueError):
+        manager.redo(n)
+
+    assert manager.get_undo_size() == 3
+    assert manager.get_redo_size() == 0
+
+
+def test_manager_too_many_steps():
+    manager = UndoRedoManager()
+    for image in make_images(3):
+        manager.push_undo_stack(image)
+
+    with pytest.raises(EmptyCommandStackError):
+        manager.undo(4)
+    with pytest.raises(EmptyCommandStackError):
+        manager.redo(1)
+
+    assert manager.get_undo_size() == 3
+
+
+def test_history_round_trip():
+    history, states = make_history()
+
+    for position in range(6, -1, -1):
+        assert np.array_equal(history.undo(), states[position])
+
+    for position in range(1, 8):
+        assert np.array_equal(history.redo(), states[position])
+
+
+def test_history_n_steps():
+    history, states = make_history()
+
+    assert np.array_equal(history.undo(5), states[2])
+    assert history.get_undo_size() == 2
+    assert history.get_redo_size() == 5
+
+    assert np.array_equal(history.redo(4), states[6])
+    assert history.get_undo_size() == 6
+    assert history.get_redo_size() == 1
+
+
+@pytest.mark.parametrize('n', [0, -1])
+def test_history_rejects_invalid_n(n):
+    history, _ = make_history()
+
+    with pytest.raises(ValueError):
+        history.undo(n)
+    with pytest.raises(ValueError):
+        history.redo(n)
+
+    assert history.get_undo_size() == 7
+    assert history.get_redo_size() == 0
+
+
+def test_history_too_many_steps():
+    history, _ = make_history()
+
+    with pytest.raises(EmptyCommandStackError):
+        history.undo(8)
+    with pytest.raises(EmptyCommandStackError):
+        history.redo(1)
+
+    assert history.get_undo_size() == 7
+
+
+def test_history_rejects_unknown_filter():
+    history, states = make_history()
+
+    with pytest.raises(ValueError):
+        history.apply_filter('No Such Filter')
+
+    assert history.get_undo_size() == 7
+    assert np.array_equal(history.current_image, states[7])
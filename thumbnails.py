@@ -0,0 +1,96 @@
+"""
+File: thumbnails.py
+Author: Adam Applegate
+Description:
+
+    Renders small previews of an image through every filter in the menu, so a
+    filter can be picked by eye instead of by trial and error. The filters run
+    on a thumbnail sized copy in a thread pool (OpenCV releases the GIL), and
+    the finished set is kept per file so reopening an image is instant
+
+"""
+
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import filter_registry
+import instrumentation
+
+# Largest size a thumbnail is rendered at
+THUMBNAIL_WIDTH = 120
+THUMBNAIL_HEIGHT = 80
+
+# How many files' thumbnails are kept
+CACHE_SIZE = 16
+
+
+class ThumbnailRenderer():
+    """ Renders an image through every menu filter at thumbnail size """
+
+    def __init__(self, image_processor, workers=None, cache_size=CACHE_SIZE,
+                 width=THUMBNAIL_WIDTH, height=THUMBNAIL_HEIGHT):
+        self.image_processor = image_processor
+
+        self.width = width
+        self.height = height
+
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count(), thread_name_prefix='filter_free_thumbnail')
+
+        # Finished thumbnails, {key: {filter name: image}}, least recently used first
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+
+
+    def cached(self, key):
+        """ Returns the thumbnails already rendered for a key, or None """
+
+        with self.lock:
+            thumbnails = self.cache.get(key)
+            if thumbnails is not None:
+                self.cache.move_to_end(key)
+
+            return thumbnails
+
+
+    def render(self, key, image, proxy_scale=1.0, names=None):
+        """ Returns {filter name: thumbnail} for an image, in menu order.
+            image may already be a reduced copy, in which case proxy_scale is its size relative to the original.
+            Filters that fail are left out, so one broken filter doesn't hide the rest """
+
+        thumbnails = self.cached(key)
+        if thumbnails is not None:
+            return thumbnails
+
+        if names is None:
+            names = filter_registry.names()
+
+        with instrumentation.span('thumbnails.render'):
+            thumbnail, scale = self.image_processor.make_proxy(image, self.width, self.height)
+            proxy_scale = proxy_scale * scale
+
+            futures = [(name, self.executor.submit(self.image_processor.filter_image, name, thumbnail,
+                                                   proxy_scale=proxy_scale, preview=True))
+                       for name in names]
+
+            thumbnails = {}
+            for name, future in futures:
+                try:
+                    thumbnails[name] = future.result()
+                except Exception as error:
+                    print(f'Could not render the {name} thumbnail: {error}')
+
+        with self.lock:
+            self.cache[key] = thumbnails
+            self.cache.move_to_end(key)
+
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return thumbnails
+
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
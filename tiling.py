@@ -0,0 +1,92 @@
+"""
+File: tiling.py
+Author: Adam Applegate
+Description: 
+
+    Runs local filters on very large images one tile at a time. Each tile is
+    read with a halo of extra pixels around it, sized from the filter's kernel,
+    so the result is identical to filtering the whole image at once. Tiles are
+    processed in parallel and written straight into a preallocated (or memory
+    mapped) output, so peak memory stays close to the size of the output
+   
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import filter_registry
+
+# Default tile edge length, in pixels (not counting the halo)
+DEFAULT_TILE_SIZE = 1024
+
+
+def tile_boxes(height, width, tile_size):
+    """ Yields (top, bottom, left, right) for each tile covering an image """
+
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            yield top, min(top + tile_size, height), left, min(left + tile_size, width)
+
+
+def filter_tiled(filter, image, tile_size=DEFAULT_TILE_SIZE, workers=None, output_path=None, **params):
+    """ Applies a registered filter to an image tile by tile.
+
+        image may be a numpy memmap, so images bigger than memory can be read lazily.
+        If output_path is given, the result is written to a .npy memory map there instead
+        of being held in memory. workers defaults to OpenCV's thread count, so a process that
+        limited OpenCV with cv2.setNumThreads doesn't start a thread per core here either.
+        Raises ValueError for filters that can't be tiled """
+
+    spec = filter_registry.get(filter)
+
+    if not spec.tileable:
+        raise ValueError(f'{filter} can not be filtered in tiles')
+
+    halo = spec.halo_for(params)
+    height, width = image.shape[:2]
+    boxes = list(tile_boxes(height, width, tile_size))
+
+    def filter_tile(box):
+        top, bottom, left, right = box
+
+        # Read the tile plus its halo, clipped to the image. At the image edges the filter's
+        # own border handling takes over, just like it would for the whole image
+        halo_top = max(top - halo, 0)
+        halo_left = max(left - halo, 0)
+        tile = np.ascontiguousarray(image[halo_top:min(bottom + halo, height), halo_left:min(right + halo, width)])
+
+        result = spec.apply(tile, **params)
+
+        # Cut the halo back off
+        return result[top - halo_top:top - halo_top + bottom - top, left - halo_left:left - halo_left + right - left]
+
+    # The first tile tells us the layout of the output
+    first = filter_tile(boxes[0])
+    shape = (height, width) + first.shape[2:]
+
+    if output_path is None:
+        output = np.empty(shape, dtype=first.dtype)
+    else:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        output = np.lib.format.open_memmap(output_path, mode='w+', dtype=first.dtype, shape=shape)
+
+    top, bottom, left, right = boxes[0]
+    output[top:bottom, left:right] = first
+
+    def write_tile(box):
+        top, bottom, left, right = box
+        output[top:bottom, left:right] = filter_tile(box)
+
+    # OpenCV releases the GIL, so threads are enough to use every core.
+    # Batch and video workers set OpenCV to one thread, since each already has a core of its own
+    with ThreadPoolExecutor(max_workers=workers or max(cv2.getNumThreads(), 1)) as executor:
+        for _ in executor.map(write_tile, boxes[1:]):
+            pass
+
+    if output_path is not None:
+        output.flush()
+
+    return output
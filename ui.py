@@ -10,15 +10,39 @@ Description:
 import tkinter as tk
 import tkinter.filedialog
 from tkinter.constants import ANCHOR
-from PIL import ImageTk, Image
 import cv2
 import os
 from functools import partial
 
+import filter_registry
+import instrumentation
+from display_surface import DisplaySurface, make_photo_image
 from image_processor import ImageProcessor
+from prefetch import FolderPrefetcher
+from result_cache import ResultCache, file_key
+from task_runner import TaskRunner
+from thumbnails import ThumbnailRenderer
 from video_processor import VideoProcessor
+from video_player import VideoPlayer
+from video_index import FrameReader, load_index
 from undo_redo_manager import UndoRedoManager
 
+# Live slider preview timing, in milliseconds. While a slider moves, a coarse preview is rendered
+# at most every SLIDER_THROTTLE ms. Once it rests for SLIDER_SETTLE ms, the canvas sized preview is rendered
+SLIDER_THROTTLE = 30
+SLIDER_SETTLE = 250
+
+# Size of the coarse preview, relative to the canvas sized proxy
+COARSE_SCALE = 0.25
+
+
+def format_time(seconds):
+    """ Formats a number of seconds as m:ss """
+
+    minutes, seconds = divmod(int(seconds), 60)
+
+    return f'{minutes}:{seconds:02d}'
+
 
 class Navbar(tk.Frame):
     """ The application's navbar """
@@ -41,6 +65,9 @@ class Navbar(tk.Frame):
         
         fileMenu.add_command(label='Open File...', command=partial(MainApplication.open_file, self.parent))
 
+        fileMenu.add_command(label='Previous in Folder', accelerator='Page Up', command=partial(MainApplication.open_in_folder, self.parent, -1))
+        fileMenu.add_command(label='Next in Folder', accelerator='Page Down', command=partial(MainApplication.open_in_folder, self.parent, 1))
+
         fileMenu.add_separator()
 
         fileMenu.add_command(label='Save', command=partial(MainApplication.save_file, self.parent))
@@ -52,6 +79,18 @@ class Navbar(tk.Frame):
 
         self.menubar.add_cascade(label='File', menu=fileMenu)
 
+        # create Submenu titled "Profiling"
+        profilingMenu = tk.Menu(self)
+
+        self.profiling_enabled = tk.BooleanVar(value=instrumentation.enabled)
+        profilingMenu.add_checkbutton(label='Enable Profiling', variable=self.profiling_enabled,
+                                      command=partial(MainApplication.toggle_profiling, self.parent, self.profiling_enabled))
+
+        profilingMenu.add_command(label='Show Stats', command=partial(MainApplication.show_stats, self.parent))
+        profilingMenu.add_command(label='Save Trace', command=partial(MainApplication.save_trace, self.parent))
+
+        self.menubar.add_cascade(label='Profiling', menu=profilingMenu)
+
         # self.menubar.add_command(label='Undo', command=partial(MainApplication.undo, MainApplication))
         # self.menubar.add_command(label='Redo', command=partial(MainApplication.redo, self))
 
@@ -93,7 +132,7 @@ class ImageToolbar(tk.Frame):
         label_drop.pack(side=('top'), pady=(15, 0))
 
         # Create filter dropdown menu
-        optionList = ['Emboss', 'Cartoon-Thick', 'Cartoon-Thin', 'Sketch', 'Invert', 'Noisy']
+        optionList = filter_registry.names()
         selected_var = tk.StringVar(self)
         selected_var.set('Filter')
         option_menu_filter = tk.OptionMenu(self.frame, selected_var, *optionList, command=self.parent.call_filter)
@@ -103,21 +142,21 @@ class ImageToolbar(tk.Frame):
         label_brightness = tk.Label(self.frame, text='Brightness')
         label_brightness.pack(side=('top'), pady=(30, 0))
 
-        self.scale_brightness = tk.Scale(self.frame, from_=-255, to=255, orient=tk.HORIZONTAL)
+        self.scale_brightness = tk.Scale(self.frame, from_=-255, to=255, orient=tk.HORIZONTAL, command=self.parent.on_scale_change)
         self.scale_brightness.pack(side=('top'))
 
         # Scale to adjust image contrast
         label_contrast = tk.Label(self.frame, text='Contrast')
         label_contrast.pack(side=('top'), pady=(15, 0))
 
-        self.scale_contrast = tk.Scale(self.frame, from_=-127, to=127, orient=tk.HORIZONTAL)
+        self.scale_contrast = tk.Scale(self.frame, from_=-127, to=127, orient=tk.HORIZONTAL, command=self.parent.on_scale_change)
         self.scale_contrast.pack(side=('top'))
 
         # Scale to adjust sharpness
         label_contrast = tk.Label(self.frame, text='Sharpness')
         label_contrast.pack(side=('top'), pady=(15, 0))
 
-        self.scale_sharpness = tk.Scale(self.frame, from_=0, to=100, orient=tk.HORIZONTAL)
+        self.scale_sharpness = tk.Scale(self.frame, from_=0, to=100, orient=tk.HORIZONTAL, command=self.parent.on_scale_change)
         self.scale_sharpness.pack(side=('top'))
 
         # Apply values in each scale
@@ -144,11 +183,35 @@ class VideoToolbar(tk.Frame):
         self.frame = tk.Frame(root)
         self.frame.grid(row=1, column=0, sticky=tk.NE)
 
-        label_video_length = tk.Label(self.frame, text='Video Length: ')
-        label_video_length.pack(side=('top'), pady=(15, 0))
+        self.label_video_length = tk.Label(self.frame, text='Video Length: ')
+        self.label_video_length.pack(side=('top'), pady=(15, 0))
 
-        label_video_size = tk.Label(self.frame, text='Video Size: ')
-        label_video_size.pack(side=('top'), pady=(15, 0))
+        self.label_video_size = tk.Label(self.frame, text='Video Size: ')
+        self.label_video_size.pack(side=('top'), pady=(15, 0))
+
+        # Scrub bar. Dragging it shows the frame at that position
+        self.label_video_position = tk.Label(self.frame, text='0:00')
+        self.label_video_position.pack(side=('top'), pady=(15, 0))
+
+        self.scale_scrub = tk.Scale(self.frame, from_=0, to=0, orient=tk.HORIZONTAL, length=200, showvalue=False, command=self.parent.scrub_video)
+        self.scale_scrub.pack(side=('top'))
+
+        # The scrub bar is also moved during playback, so only the user's own moves seek
+        self.scale_scrub.bind('<ButtonPress-1>', lambda event: self.parent.set_scrubbing(True))
+        self.scale_scrub.bind('<ButtonRelease-1>', lambda event: self.parent.set_scrubbing(False))
+
+        # Seek & pause controls
+        frame_controls = tk.Frame(self.frame)
+        frame_controls.pack(side='bottom', pady=(15, 0))
+
+        btn_back = tk.Button(frame_controls, text='<< 5s', command=partial(self.parent.seek_video, -5))
+        btn_back.pack(side='left')
+
+        btn_pause_video = tk.Button(frame_controls, text='Pause', command=self.parent.pause_video)
+        btn_pause_video.pack(side='left')
+
+        btn_forward = tk.Button(frame_controls, text='5s >>', command=partial(self.parent.seek_video, 5))
+        btn_forward.pack(side='left')
 
         btn_play_video = tk.Button(self.frame, text='Play Video', command=self.parent.play_video)
         btn_play_video.pack(side='bottom', pady=(200, 0))
@@ -175,6 +238,16 @@ class Display(tk.Frame):
         self.canvas = tk.Canvas(frame, width=1080, height=720, background='gray')
         self.canvas.pack(side='top')
 
+        # Draws images on the canvas, reusing one canvas item
+        self.surface = DisplaySurface(self.canvas, 1080, 720)
+
+        # A row of previews of the image through each filter. Clicking one applies the filter
+        self.frame_thumbnails = tk.Frame(frame)
+        self.frame_thumbnails.pack(side='top', fill=tk.X)
+
+        # Keeps the thumbnail PhotoImages from being garbage collected
+        self.thumbnail_images = []
+
         # Label that displays the filename
         self.label_canvas = tk.Label(frame, text=self.parent.filename, font=('Helvetica', 15))
         self.label_canvas.pack(side='left')
@@ -184,10 +257,36 @@ class Display(tk.Frame):
         self.label_messages.pack(side='right')
 
 
+    def show_thumbnails(self, thumbnails):
+        """ Replaces the filter previews. thumbnails is {filter name: image} """
+
+        self.clear_thumbnails()
+
+        for name, thumbnail in thumbnails.items():
+            image = make_photo_image(thumbnail)
+            self.thumbnail_images.append(image)
+
+            button = tk.Button(self.frame_thumbnails, image=image, text=name, compound='top',
+                               command=partial(self.parent.call_filter, name))
+            button.pack(side='left', padx=2, pady=2)
+
+
+    def clear_thumbnails(self):
+        """ Removes the filter previews """
+
+        for widget in self.frame_thumbnails.winfo_children():
+            widget.destroy()
+
+        self.thumbnail_images = []
+
+
 class MainApplication(tk.Frame):
     """ The main program. Contains the navbar, toolbar, and display classes, and most of the logic that ties everything together. """
 
-    image_processor = ImageProcessor()
+    image_processor = ImageProcessor(cache=ResultCache(disk_dir='temp/cache'))
+
+    # Renders the filter previews shown under the canvas
+    thumbnail_renderer = ThumbnailRenderer(image_processor)
     video_processor = VideoProcessor()
     # command_manager = UndoRedoManager()
 
@@ -197,11 +296,44 @@ class MainApplication(tk.Frame):
     filename = None
     filetype = None
 
-    # The original image without edits
+    # The original image without edits. For images this is a LazyImage, which only
+    # decodes the full resolution pixels when they're needed
     original_file = None
 
     # The edited image
     processed_file = None
+
+    # A copy of the original image shrunk to fit the canvas. Edits are previewed on it,
+    # and only rendered at full resolution when saving
+    proxy_file = None
+    proxy_scale = 1.0
+
+    # An even smaller copy of the proxy, used for live previews while a slider is moving
+    coarse_file = None
+    coarse_scale = 1.0
+
+    # Renders the last edit on a given image & scale. None if the image hasn't been edited
+    last_edit = None
+
+    # Pending after() callbacks for the live slider preview
+    coarse_preview_id = None
+    settle_preview_id = None
+
+    # The slider values last previewed or applied, so unchanged values don't trigger another preview
+    shown_scale_values = (0, 0, 0)
+
+    # Plays the loaded video without blocking the UI
+    video_player = None
+
+    # The loaded video's frame index (built in the background), a reader for single frames,
+    # and the index of the frame on screen
+    video_index = None
+    video_reader = None
+    video_position = 0
+    video_scrubbing = False
+
+    # Steps through the images in the loaded image's folder, decoding the neighbours ahead
+    prefetcher = None
     
     def __init__(self, parent, *args, **kwargs):
         super().__init__()
@@ -213,6 +345,13 @@ class MainApplication(tk.Frame):
         self.video_toolbar = VideoToolbar(self)
         self.display = Display(self)
 
+        # Runs filters in the background so the window stays responsive
+        self.task_runner = TaskRunner(self.display.canvas, on_progress=self.show_progress)
+
+        # Page Up/Down step through the images in the folder
+        root.bind('<Prior>', lambda event: self.open_in_folder(-1))
+        root.bind('<Next>', lambda event: self.open_in_folder(1))
+
         # Determine the location of each UI piece
         self.navbar.grid(row=0, column=0, sticky=tk.NSEW)
         self.image_toolbar.grid(row=1, column=0)
@@ -264,11 +403,29 @@ class MainApplication(tk.Frame):
 
         # Make sure a file was actually loaded
         if (filepath is not None):
+            # Drop any preview still being rendered for the previous file
+            self.cancel_scale_previews()
+            self.task_runner.cancel('render')
+            self.task_runner.cancel('thumbnails')
+            self.display.clear_thumbnails()
+
+            # Stop any video that is still playing
+            if (self.video_player is not None):
+                self.video_player.close()
+                self.video_player = None
+
+            if (self.video_reader is not None):
+                self.task_runner.cancel('video_index')
+                self.task_runner.cancel('video_frame')
+                self.video_reader.release()
+                self.video_reader = None
+
             # Update the filepath
             self.filepath = filepath
 
-            # Determine the filetype
-            self.filetype = self.filepath.split('.')[1]
+            # Determine the filetype from the extension, lowercased so IMG_001.JPG counts as a jpg.
+            # Folders with dots in their names don't confuse it
+            self.filetype = os.path.splitext(self.filepath)[1][1:].lower()
 
             # Isolate the name of the file
             file_pieces = self.filepath.split('/')
@@ -276,11 +433,16 @@ class MainApplication(tk.Frame):
 
             # It's an image
             if (self.filetype != 'mp4'):
-                # Load the image
-                self.original_file = cv2.imread(self.filepath)
+                # Read the image size and decode a reduced size preview. Images stay in OpenCV's BGR order,
+                # and are only converted for display. Images next to it in the folder are decoded ahead
+                folder = os.path.dirname(os.path.abspath(self.filepath))
+                if (self.prefetcher is None or self.prefetcher.folder != folder):
+                    if (self.prefetcher is not None):
+                        self.prefetcher.shutdown()
+
+                    self.prefetcher = FolderPrefetcher(folder, 1080, 720)
 
-                # Set the correct color channels
-                self.original_file = cv2.cvtColor(self.original_file, cv2.COLOR_BGR2RGB)
+                self.original_file = self.prefetcher.open(self.filepath)
 
                 # Load the image toolbar & hide the video toolbar
                 self.show_image_toolbar()
@@ -290,15 +452,60 @@ class MainApplication(tk.Frame):
                 # Load the video
                 self.original_file = cv2.VideoCapture(self.filepath)
 
+                # Single frames are read through their own capture, so the shared one isn't advanced
+                self.video_index = None
+                self.video_reader = FrameReader(self.filepath)
+                self.video_position = 0
+
+                # The header's frame count is an estimate. The index replaces it once it's built
+                frame_count = int(self.original_file.get(cv2.CAP_PROP_FRAME_COUNT))
+                self.video_toolbar.scale_scrub.configure(to=max(frame_count - 1, 0))
+                self.video_toolbar.scale_scrub.set(0)
+
+                self.task_runner.submit('video_index', load_index, self.filepath,
+                                        on_done=self.video_index_loaded,
+                                        on_error=partial(self.task_failed, 'Error indexing video'))
+
                 # Load the video toolbar & hide the image toolbar
                 self.show_video_toolbar()
 
             # Load a second reference to edit without changing the original 
             self.processed_file = self.original_file
+            self.last_edit = None
+
+            # Shrink images to fit the canvas for previewing edits
+            if (self.filetype != 'mp4'):
+                preview = self.original_file.preview
+                self.proxy_file, scale = self.image_processor.make_proxy(preview, 1080, 720)
+
+                # The preview may already be reduced, so measure the scale against the full size
+                self.proxy_scale = scale * preview.shape[1] / self.original_file.width
+                self.processed_file = self.proxy_file
+
+                proxy_height, proxy_width = self.proxy_file.shape[:2]
+                self.coarse_file, scale = self.image_processor.make_proxy(self.proxy_file, proxy_width * COARSE_SCALE, proxy_height * COARSE_SCALE)
+                self.coarse_scale = self.proxy_scale * scale
+
+                self.load_thumbnails()
 
             self.display.label_canvas = self.filename
 
             
+    def load_thumbnails(self):
+        """ Renders the filter previews for the loaded image in the background. Reopened images reuse their previews """
+
+        key = file_key(self.filepath)
+
+        thumbnails = self.thumbnail_renderer.cached(key)
+        if (thumbnails is not None):
+            self.display.show_thumbnails(thumbnails)
+            return
+
+        self.task_runner.submit('thumbnails', self.thumbnail_renderer.render, key, self.proxy_file, self.proxy_scale,
+                                on_done=self.display.show_thumbnails,
+                                on_error=partial(self.task_failed, 'Error rendering filter previews'))
+
+
     def show_image_toolbar(self):
         """ Show the image toolbar and hide the video toolbar """
 
@@ -316,83 +523,111 @@ class MainApplication(tk.Frame):
         # Is the loaded object an image or a video?
 
         if (self.filetype != None and self.filetype != 'mp4'):
-            image_canvas = self.processed_file
+            self.display.surface.show(self.processed_file)
+
+        elif (self.filetype != None and self.filetype == 'mp4'):
+            # Show the frame at the current position
+            try:
+                self.show_video_frame(self.video_reader.read(self.video_position), self.video_position)
+            except IOError as error:
+                self.task_failed('Error reading video', error)
+        
+        else:
+            self.message_user('Error', 'red')
 
-            shape = image_canvas.shape
-            image_height = shape[0]
-            image_width = shape[1]
 
-            # If the image is larger than the screen, resize it to fit
-            if (image_height > 720 or image_width > 1080):
-                scale = image_height / 720
-                image_canvas = cv2.resize(image_canvas, (int(image_width/scale), int(image_height/scale)), interpolation=cv2.INTER_CUBIC)
+    def play_video(self):
+        """ Plays a video loaded into the display area. Frames are shown from the Tk event loop, so the UI stays responsive """
 
-            # Convert the numpy array to a PIL image that can be displayed on Tkinter canvas
-            image_canvas = ImageTk.PhotoImage(Image.fromarray(image_canvas))
+        if (self.filetype != 'mp4'):
+            return
 
-            # Prevent garbage collection from deleting the image
-            root.image_canvas = image_canvas
+        if (self.video_player is None):
+            self.video_player = VideoPlayer(self.display.canvas, self.filepath, self.show_video_frame,
+                                            on_finished=partial(self.message_user, 'Video finished', 'green'),
+                                            index=self.video_index)
 
-            # Display the image on the center of the canvas
-            self.display.canvas.create_image(540, 360, image=image_canvas)
+            # Start from wherever the scrub bar was left
+            if (self.video_position > 0):
+                self.video_player.seek(self.video_position)
 
-        elif (self.filetype != None and self.filetype == 'mp4'):
-            # Load the first frame of the video
-            ret, image_canvas = self.processed_file.read()
+        # Start again from the beginning once the video has finished
+        elif (self.video_player.position >= self.video_player.frame_count - 1):
+            self.video_player.seek(0)
 
-            # If the frame was successfully loaded
-            if (ret == True):
-                # Make sure the correct color channel is selected
-                image_canvas = cv2.cvtColor(image_canvas, cv2.COLOR_BGR2RGBA)
+        self.video_player.play()
 
-                image_height, image_width, _ = image_canvas.shape
 
-                # If the image is larger than the screen, resize it to fit
-                if (image_height > 720 or image_width > 1080):
-                    scale = image_height / 720
-                    image_canvas = cv2.resize(image_canvas, (int(image_width/scale), int(image_height/scale)), interpolation=cv2.INTER_CUBIC)
+    def pause_video(self):
+        """ Pauses or resumes the video """
 
-                # Convert the numpy array to a PIL image that can be displayed on Tkinter canvas
-                image_canvas = ImageTk.PhotoImage(Image.fromarray(image_canvas))
+        if (self.video_player is not None):
+            self.video_player.toggle()
 
-                 # Prevent garbage collection from deleting the image
-                root.image_canvas = image_canvas
 
-                # Display the image on the center of the canvas
-                self.display.canvas.create_image(540, 360, image=image_canvas)
-        
-        else:
-            self.message_user('Error', 'red')
+    def seek_video(self, seconds):
+        """ Moves the video forwards or backwards by a number of seconds """
 
+        if (self.video_player is not None):
+            self.video_player.seek_seconds(seconds)
 
-    def play_video(self):
-        """ Plays a video loaded into the display area """
 
-        while (self.processed_file.isOpened):
-            # Load each frame of the video
-            ret, image_canvas = self.processed_file.read()
+    def video_index_loaded(self, index):
+        """ The loaded video's frame index is ready. Seeking is frame accurate from here on """
 
-            # If the frame was successfully loaded
-            if (ret == True):
-                # Make sure the correct color channel is selected
-                image_canvas = cv2.cvtColor(image_canvas, cv2.COLOR_BGR2RGBA)
+        self.video_index = index
+        self.video_reader.set_index(index)
 
-                image_height, image_width, _ = image_canvas.shape
+        if (self.video_player is not None):
+            self.video_player.index = index
+            self.video_player.frame_count = index.frame_count
 
-                # If the image is larger than the screen, resize it to fit
-                if (image_height > 720 or image_width > 1080):
-                    scale = image_height / 720
-                    image_canvas = cv2.resize(image_canvas, (int(image_width/scale), int(image_height/scale)), interpolation=cv2.INTER_CUBIC)
+        self.video_toolbar.scale_scrub.configure(to=max(index.frame_count - 1, 0))
+        self.video_toolbar.label_video_length.configure(text=f'Video Length: {format_time(index.duration)}')
+        self.video_toolbar.label_video_size.configure(text=f'Video Size: {index.width} x {index.height}')
 
-                # Convert the numpy array to a PIL image that can be displayed on Tkinter canvas
-                image_canvas = ImageTk.PhotoImage(Image.fromarray(image_canvas))
 
-                 # Prevent garbage collection from deleting the image
-                root.image_canvas = image_canvas
+    def set_scrubbing(self, scrubbing):
+        """ The user pressed or released the scrub bar """
+
+        # The last move can still be waiting to be reported when the bar is released
+        if (not scrubbing and self.video_scrubbing):
+            self.scrub_video(self.video_toolbar.scale_scrub.get())
+
+        self.video_scrubbing = scrubbing
+
+
+    def scrub_video(self, value):
+        """ The scrub bar moved. Shows the frame at its position """
+
+        frame_index = int(float(value))
+
+        # Moved by show_video_frame, not the user
+        if (not self.video_scrubbing or frame_index == self.video_position or self.video_reader is None):
+            return
+
+        if (self.video_player is not None):
+            self.video_player.seek(frame_index)
+            return
+
+        # Newer positions supersede older ones, so dragging only ever decodes the latest frame
+        self.task_runner.submit('video_frame', self.video_reader.read, frame_index,
+                                on_done=partial(self.show_video_frame, frame_index=frame_index),
+                                on_error=partial(self.task_failed, 'Error reading video'))
+
+
+    def show_video_frame(self, frame, frame_index):
+        """ Displays a single video frame on the canvas """
+
+        self.display.surface.show(frame)
+
+        # Keep the scrub bar in step with what's on screen
+        self.video_position = frame_index
+        self.video_toolbar.scale_scrub.set(frame_index)
+
+        fps = self.video_index.fps if self.video_index is not None else self.video_reader.fps
+        self.video_toolbar.label_video_position.configure(text=format_time(frame_index / fps))
 
-                # Display the image on the center of the canvas
-                self.display.canvas.create_image(540, 360, image=image_canvas)
-    
 
     def call_filter(self, filter):
         """ Takes input from the dropdown menu,and calls the selected filter """
@@ -401,34 +636,162 @@ class MainApplication(tk.Frame):
             # self.command_manager.push_undo_stack(self.processed_file)
             # self.manage_commands()
 
-            self.processed_file = self.image_processor.filter_image(filter, self.original_file)
+            # A pending slider preview would otherwise replace the filter on screen
+            self.cancel_scale_previews()
+
+            self.last_edit = partial(self.image_processor.filter_image, filter)
+            self.start_render(f'Applying {filter} filter', f'{filter} filter Applied!')
 
         else:
             self.message_user('Unknown filetype', 'red')
             return
 
-        self.message_user(f'{filter} filter Applied!', 'green')
 
-        self.refresh_canvas()
+    def on_scale_change(self, value):
+        """ A slider moved. Schedules a coarse live preview, and a full preview once the slider rests """
+
+        if (self.filetype == None or self.filetype == 'mp4' or self.coarse_file is None):
+            return
+
+        if (self.get_scale_values() == self.shown_scale_values):
+            return
+
+        # Throttle coarse previews while the slider moves
+        if (self.coarse_preview_id is None):
+            self.coarse_preview_id = self.display.canvas.after(SLIDER_THROTTLE, self.preview_scales_coarse)
+
+        # Debounce the canvas sized preview until the slider rests
+        if (self.settle_preview_id is not None):
+            self.display.canvas.after_cancel(self.settle_preview_id)
+        self.settle_preview_id = self.display.canvas.after(SLIDER_SETTLE, self.preview_scales)
+
+
+    def preview_scales_coarse(self):
+        """ Renders the slider values on the coarse copy, superseding any render in progress """
+
+        self.coarse_preview_id = None
+
+        edit = partial(self.image_processor.filter_apply_scales, *self.get_scale_values())
+
+        self.task_runner.submit('render', self.render_coarse, edit, self.coarse_file, self.coarse_scale, self.proxy_file.shape,
+                                on_done=partial(self.finish_render, 'Previewing...', 'orange'),
+                                on_error=partial(self.task_failed, 'Error applying filter'))
+
+
+    def preview_scales(self):
+        """ Renders the slider values on the canvas sized proxy. Only a preview: the values
+            aren't kept as the image's edit until Apply is pressed """
+
+        self.cancel_scale_previews()
+
+        self.shown_scale_values = self.get_scale_values()
+        edit = partial(self.image_processor.filter_apply_scales, *self.shown_scale_values)
+
+        self.task_runner.submit('render', edit, self.proxy_file, proxy_scale=self.proxy_scale, preview=True,
+                                on_done=partial(self.finish_render, 'Previewing. Press Apply to keep these values', 'orange'),
+                                on_error=partial(self.task_failed, 'Error applying filter'))
+
+
+    def render_coarse(self, edit, coarse_file, coarse_scale, proxy_shape):
+        """ Runs on a worker thread. Renders an edit on the coarse copy and enlarges it to the proxy's size """
+
+        image = edit(coarse_file, proxy_scale=coarse_scale, preview=True)
+
+        return cv2.resize(image, (proxy_shape[1], proxy_shape[0]), interpolation=cv2.INTER_LINEAR)
+
+
+    def get_scale_values(self):
+        """ Returns the brightness, contrast & sharpness slider values """
+
+        return (self.image_toolbar.scale_brightness.get(),
+                self.image_toolbar.scale_contrast.get(),
+                self.image_toolbar.scale_sharpness.get())
+
+
+    def cancel_scale_previews(self):
+        """ Cancels any live slider previews that haven't started yet """
+
+        if (self.coarse_preview_id is not None):
+            self.display.canvas.after_cancel(self.coarse_preview_id)
+            self.coarse_preview_id = None
+
+        if (self.settle_preview_id is not None):
+            self.display.canvas.after_cancel(self.settle_preview_id)
+            self.settle_preview_id = None
 
 
     def apply_scales(self):
         """ Takes input from the scales, and calls the appropriate filter """
 
+        self.cancel_scale_previews()
+
         # self.command_manager.push_undo_stack(self.processed_file)
         # self.manage_commands()
 
-        self.processed_file = self.image_processor.filter_apply_scales(
-                        self.image_toolbar.scale_brightness.get(), 
-                        self.image_toolbar.scale_contrast.get(), 
-                        self.image_toolbar.scale_sharpness.get(),
-                        self.original_file)
+        self.shown_scale_values = self.get_scale_values()
+
+        self.last_edit = partial(self.image_processor.filter_apply_scales, *self.shown_scale_values)
+        self.start_render('Applying slider values', 'Slider values applied!')
+
+
+    def start_render(self, description, message, color='green'):
+        """ Renders the last edit on the canvas sized proxy in the background, then displays it.
+            Starting a new render supersedes any render still in progress """
+
+        self.task_runner.submit('render', self.last_edit, self.proxy_file, proxy_scale=self.proxy_scale, preview=True,
+                                description=description,
+                                on_done=partial(self.finish_render, message, color),
+                                on_error=partial(self.task_failed, 'Error applying filter'))
+
+
+    def finish_render(self, message, color, processed_file):
+        """ A background render finished. Display the result """
 
-        self.message_user('Slider values applied!', 'green')
+        self.processed_file = processed_file
+
+        self.message_user(message, color)
 
         self.refresh_canvas()
 
 
+    def task_failed(self, message, error):
+        """ A background task raised an error """
+
+        print(f'{message}: {error!r}')
+
+        self.message_user(message, 'red')
+
+
+    def show_progress(self, description, elapsed):
+        """ Shows how long a background task has been running """
+
+        self.message_user(f'{description}... {elapsed:.1f}s', 'orange')
+
+
+    def save_image(self, filepath):
+        """ Renders the last edit at full resolution and writes it to filepath, in the background """
+
+        # Saves must never be superseded, or an earlier save would be silently dropped
+        self.task_runner.submit('save', self.write_full_resolution, self.last_edit, self.original_file, filepath,
+                                description='Saving image', supersede=False,
+                                on_done=partial(self.message_user, 'Image saved successfully', 'green'),
+                                on_error=partial(self.task_failed, 'Error saving file'))
+
+
+    def write_full_resolution(self, edit, original_file, filepath):
+        """ Runs on a worker thread. Renders an edit on the full resolution original and saves it """
+
+        # Decodes the full resolution image if this is the first time it's needed
+        image = original_file.full
+        if (edit is not None):
+            image = edit(image)
+
+        # Images are already in the BGR (or grayscale) layout cv2.imwrite expects
+        with instrumentation.span('save.encode'):
+            if not cv2.imwrite(filepath, image):
+                raise IOError(f'could not write {filepath}')
+
+
     def reset_scales(self):
         """ Resets the scales to 0 """
 
@@ -436,15 +799,11 @@ class MainApplication(tk.Frame):
         self.image_toolbar.scale_contrast.set(0)
         self.image_toolbar.scale_sharpness.set(0)
 
-        self.processed_file = self.image_processor.filter_apply_scales(
-                        self.image_toolbar.scale_brightness.get(), 
-                        self.image_toolbar.scale_contrast.get(), 
-                        self.image_toolbar.scale_sharpness.get(),
-                        self.original_file)
+        self.cancel_scale_previews()
+        self.shown_scale_values = self.get_scale_values()
 
-        self.message_user('Slider values reset', 'orange')
-
-        self.refresh_canvas()
+        self.last_edit = partial(self.image_processor.filter_apply_scales, *self.shown_scale_values)
+        self.start_render('Resetting slider values', 'Slider values reset', 'orange')
 
 
     def on_exit(self):
@@ -484,6 +843,24 @@ class MainApplication(tk.Frame):
             
 
 
+    def open_in_folder(self, step):
+        """ Opens the image step places after (or before, if negative) the current one in its folder """
+
+        if (self.filetype == None or self.filetype == 'mp4' or self.prefetcher is None):
+            self.message_user('Open an image to step through its folder', 'orange')
+            return
+
+        filepath = self.prefetcher.neighbour(step)
+        if (filepath is None):
+            self.message_user('No more images in this folder', 'orange')
+            return
+
+        self.update_file_type(filepath)
+        self.refresh_canvas()
+
+        self.message_user(f'{self.filename} ({self.prefetcher.index + 1} of {len(self.prefetcher)})', 'green')
+
+
     def save_file(self):
         """ Save the file to the saved filepath """
 
@@ -517,12 +894,8 @@ class MainApplication(tk.Frame):
 
             self.message_user('Video saved successfully', 'green')
 
-        elif (self.filetype == 'jpg' or self.filetype == 'png'):
-            #Make sure the correct color channels are selected
-            self.processed_file = cv2.cvtColor(self.processed_file, cv2.COLOR_BGR2RGBA)
-
-            cv2.imwrite(self.filepath, self.processed_file)
-            self.message_user('Image saved successfully', 'green')
+        elif (self.filetype == 'jpg' or self.filetype == 'jpeg' or self.filetype == 'png'):
+            self.save_image(self.filepath)
 
 
     def save_file_as(self):
@@ -577,11 +950,39 @@ class MainApplication(tk.Frame):
 
             # Save an image
             else:
-                #Make sure the correct color channels are selected
-                self.processed_file = cv2.cvtColor(self.processed_file, cv2.COLOR_BGR2RGBA)
-                cv2.imwrite(filepath, self.processed_file)
-                self.message_user('Image saved successfully', 'green')
+                self.save_image(filepath)
+
+
+
+    def toggle_profiling(self, enabled):
+        """ Turns timing of each processing stage on or off """
+
+        if (enabled.get()):
+            instrumentation.enable(trace=True)
+            self.message_user('Profiling enabled', 'green')
+        else:
+            instrumentation.disable()
+            self.message_user('Profiling disabled', 'orange')
+
+
+    def show_stats(self):
+        """ Opens a window with the time spent in each processing stage """
+
+        window = tk.Toplevel(self.parent)
+        window.title('Performance Stats')
+
+        text = tk.Text(window, width=90, height=25, font=('Courier', 10))
+        text.insert('1.0', instrumentation.summary())
+        text.config(state='disabled')
+        text.pack(side='top', fill=tk.BOTH, expand=True)
+
+
+    def save_trace(self):
+        """ Writes the recorded stages to a trace file that opens in chrome://tracing """
+
+        instrumentation.write_trace('temp/trace.json')
 
+        self.message_user('Trace saved to temp/trace.json', 'green')
 
 
     def message_user(self, message, color):
@@ -1,13 +1,160 @@
+
 # Credit to Donz0r for help with this code. It has been adapted to the needs of the program
 # https://derdon.github.io/blog/implementing-an-undo-redo-manager-in-python.html
 
+import itertools
+import tempfile
+import zlib
+
+import numpy as np
+
+import filter_registry
+from image_processor import ImageProcessor
+
+# Default limit for the compressed images kept in memory (256 MB)
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# Every Nth image in a stack is stored whole. The ones in between are stored as
+# deltas against the image below them, so decoding never replays more than N - 1 deltas
+KEYFRAME_INTERVAL = 8
+
+# zlib level. 1 is much faster than the default and compresses deltas nearly as well
+COMPRESSION_LEVEL = 1
+
+
 class EmptyCommandStackError(Exception):
     pass
 
+
+class StackEntry(object):
+    """ A single compressed image in an undo or redo stack """
+
+    def __init__(self, sequence, shape, dtype, is_delta, data):
+        # Increases with every push, so the oldest entries can be found
+        self.sequence = sequence
+
+        self.shape = shape
+        self.dtype = dtype
+
+        # If True, data holds the difference from the image below this one
+        self.is_delta = is_delta
+
+        # The compressed bytes, or None once they've been spilled to disk
+        self.data = data
+
+        # Where the bytes live in the spill file, once spilled
+        self.offset = None
+        self.length = len(data)
+
+
+class ImageStack(object):
+    """ A stack of images, stored compressed and spilled to a temp file when over budget """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.entries = []
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def push(self, image):
+        """ Compress an image and push it onto the stack """
+
+        image = np.ascontiguousarray(image)
+        index = len(self.entries)
+
+        base = None
+        if index % KEYFRAME_INTERVAL != 0:
+            base = self.image_at(index - 1)
+
+            # Deltas only work between images with the same layout
+            if base.shape != image.shape or base.dtype != image.dtype:
+                base = None
+
+        if base is None:
+            raw = image
+        else:
+            # Wrapping subtraction is lossless, and unchanged pixels become 0
+            raw = image - base
+
+        data = zlib.compress(raw.tobytes(), COMPRESSION_LEVEL)
+        entry = StackEntry(self.manager.next_sequence(), image.shape, image.dtype, base is not None, data)
+
+        self.entries.append(entry)
+        self.manager.memory_used = self.manager.memory_used + entry.length
+
+        self.manager.enforce_budget()
+
+
+    def pop(self):
+        """ Remove the top image from the stack and return it """
+
+        if len(self.entries) == 0:
+            raise EmptyCommandStackError()
+
+        image = self.image_at(len(self.entries) - 1)
+
+        entry = self.entries.pop()
+        self.manager.release(entry)
+
+        return image
+
+
+    def image_at(self, index):
+        """ Decode the image at an index, replaying deltas from the nearest whole image below it """
+
+        start = index
+        while self.entries[start].is_delta:
+            start = start - 1
+
+        image = self.decode(self.entries[start])
+        for entry in self.entries[start + 1:index + 1]:
+            image = image + self.decode(entry)
+
+        # A decoded whole image is a read-only view of the decompressed bytes. Copy it,
+        # so callers always get a writeable image, like the ones rebuilt from deltas
+        if start == index:
+            image = image.copy()
+
+        return image
+
+
+    def decode(self, entry):
+        data = entry.data
+        if data is None:
+            data = self.manager.read_spilled(entry)
+
+        return np.frombuffer(zlib.decompress(data), dtype=entry.dtype).reshape(entry.shape)
+
+
+    def clear(self):
+        for entry in self.entries:
+            self.manager.release(entry)
+
+        self.entries = []
+
+
 class UndoRedoManager(object):
-    def __init__(self):
-        self.undo_stack = []
-        self.redo_stack = []
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        # Maximum number of compressed bytes to keep in memory. Older images go to disk past this
+        self.memory_budget = memory_budget
+
+        self.memory_used = 0
+
+        # Bytes of spilled images still in a stack, and the size of the spill file. The file also
+        # holds the bytes of removed images until it's compacted
+        self.disk_used = 0
+        self.spill_size = 0
+
+        self.undo_stack = ImageStack(self)
+        self.redo_stack = ImageStack(self)
+
+        self.sequence = itertools.count()
+
+        # Temp file holding spilled images. Created the first time it's needed
+        self.spill_file = None
 
 
     def get_undo_size(self):
@@ -22,61 +169,308 @@ class UndoRedoManager(object):
         return len(self.redo_stack)
 
 
+    def get_memory_usage(self):
+        """ Return the number of bytes the stored images take up in memory """
+
+        return self.memory_used
+
+
+    def get_disk_usage(self):
+        """ Return the number of bytes the spill file takes up on disk """
+
+        return self.spill_size
+
+
     def push_undo_stack(self, image):
         """ Push the image to the undo stack """
 
-        self.undo_stack.append(image)
+        self.undo_stack.push(image)
 
 
     def pop_undo_stack(self):
         """ Remove the last command from the undo stack and return it.
             Throws an error if the undo stack is empty """
 
-        try:
-            last_undo = self.undo_stack.pop()
-
-        except IndexError:
-            raise EmptyCommandStackError()
-
-        return last_undo
+        return self.undo_stack.pop()
 
 
     def push_redo_stack(self, image):
         """ Push the image to the redo stack """
 
-        self.redo_stack.append(image)
+        self.redo_stack.push(image)
 
 
     def pop_redo_stack(self):
         """ Remove the last command from the redo stack and return it.
             Throws an error if the redo stack is empty """
 
-        try:
-            last_redo = self.redo_stack.pop()
+        return self.redo_stack.pop()
 
-        except IndexError:
-            raise EmptyCommandStackError()
 
-        return last_redo
+    def undo(self, n=1):
+        """ Undo the last N commands (defaults to 1).
+            Moves N images from the undo stack to the redo stack and returns the last one moved.
+            Throws an error, without moving anything, if there are fewer than N images """
 
+        if n < 1:
+            raise ValueError(f'can not undo {n} commands')
 
-    def undo(self, n=1):
-        """ Undo the last N commands (defaults to 1). 
-            Removes the image from the undo stack and adds it to the redo stack """
+        if n > len(self.undo_stack):
+            raise EmptyCommandStackError()
 
         for _ in range(n):
             image = self.pop_undo_stack()
             self.push_redo_stack(image)
 
-            return image
+        return image
 
 
     def redo(self, n=1):
-        """ Redo the last N commands (defaults to 1). 
-            Removes the image from the redo stack and adds it to the undo stack """
+        """ Redo the last N commands (defaults to 1).
+            Moves N images from the redo stack to the undo stack and returns the last one moved.
+            Throws an error, without moving anything, if there are fewer than N images """
+
+        if n < 1:
+            raise ValueError(f'can not redo {n} commands')
+
+        if n > len(self.redo_stack):
+            raise EmptyCommandStackError()
 
         for _ in range(n):
             image = self.pop_redo_stack()
             self.push_undo_stack(image)
 
-            return image
\ No newline at end of file
+        return image
+
+
+    def clear(self):
+        """ Remove every image from both stacks """
+
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+
+    def next_sequence(self):
+        return next(self.sequence)
+
+
+    def enforce_budget(self):
+        """ Spill the oldest in-memory images to disk until memory use is within budget """
+
+        if self.memory_budget is None or self.memory_used <= self.memory_budget:
+            return
+
+        in_memory = [entry for entry in self.undo_stack.entries + self.redo_stack.entries if entry.data is not None]
+        in_memory.sort(key=lambda entry: entry.sequence)
+
+        for entry in in_memory:
+            if self.memory_used <= self.memory_budget:
+                break
+
+            self.spill(entry)
+
+
+    def spill(self, entry):
+        """ Move an entry's bytes from memory to the spill file """
+
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix='filter_free_undo_')
+
+        self.spill_file.seek(self.spill_size)
+        entry.offset = self.spill_size
+        self.spill_file.write(entry.data)
+
+        entry.data = None
+        self.memory_used = self.memory_used - entry.length
+        self.disk_used = self.disk_used + entry.length
+        self.spill_size = self.spill_size + entry.length
+
+
+    def read_spilled(self, entry):
+        self.spill_file.seek(entry.offset)
+
+        return self.spill_file.read(entry.length)
+
+
+    def release(self, entry):
+        """ Stop accounting for an entry that was removed from a stack """
+
+        if entry.data is None:
+            self.disk_used = self.disk_used - entry.length
+        else:
+            self.memory_used = self.memory_used - entry.length
+
+        # Once most of the spill file belongs to removed images, rewrite it with only the live ones.
+        # Each rewrite copies fewer bytes than were freed since the last one
+        if self.spill_file is not None and self.spill_size > 2 * self.disk_used:
+            self.compact()
+
+
+    def compact(self):
+        """ Rewrite the spill file with only the images still in a stack """
+
+        spilled = [entry for entry in self.undo_stack.entries + self.redo_stack.entries if entry.data is None]
+        spilled.sort(key=lambda entry: entry.offset)
+
+        compacted = tempfile.TemporaryFile(prefix='filter_free_undo_')
+        for entry in spilled:
+            data = self.read_spilled(entry)
+            entry.offset = compacted.tell()
+            compacted.write(data)
+
+        self.spill_file.close()
+        self.spill_file = compacted
+        self.spill_size = compacted.tell()
+
+
+# How many commands apart full image checkpoints are kept in a CommandHistory
+DEFAULT_CHECKPOINT_INTERVAL = 10
+
+
+class Command(object):
+    """ A single edit: a filter name and the parameters it was called with """
+
+    def __init__(self, filter, params):
+        self.filter = filter
+        self.params = dict(params)
+
+
+    def apply(self, image_processor, image):
+        """ Run the edit on an image """
+
+        return image_processor.filter_image(self.filter, image, **self.params)
+
+
+    def is_deterministic(self):
+        """ Whether replaying the edit gives the same image every time """
+
+        return filter_registry.get(self.filter).is_deterministic(self.params)
+
+
+class CommandHistory(object):
+    """ Undo/redo history that stores the edits themselves instead of an image per edit.
+
+        A full image is only kept every checkpoint_interval commands (and after any command
+        that can't be replayed exactly). Any other state is rebuilt by replaying commands from
+        the nearest checkpoint, so a larger interval trades undo speed for memory """
+
+    def __init__(self, image, image_processor=None, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        self.image_processor = image_processor or ImageProcessor()
+        self.checkpoint_interval = checkpoint_interval
+
+        # Every command applied since the original image, including undone ones that can be redone
+        self.commands = []
+
+        # How many of the commands are currently applied
+        self.position = 0
+
+        # Full images, keyed by the number of commands applied to get them
+        self.checkpoints = {0: image}
+
+        self.current_image = image
+
+
+    def get_undo_size(self):
+        """ Return the number of commands that can be undone """
+
+        return self.position
+
+
+    def get_redo_size(self):
+        """ Return the number of commands that can be redone """
+
+        return len(self.commands) - self.position
+
+
+    def get_memory_usage(self):
+        """ Return the number of bytes used by checkpoint images """
+
+        return sum(image.nbytes for image in self.checkpoints.values())
+
+
+    def apply_filter(self, filter, **params):
+        """ Apply a filter to the current image and record it. Returns the new image """
+
+        return self.record(Command(filter, params))
+
+
+    def apply_scales(self, brightness, contrast, sharpness):
+        """ Apply the brightness, contrast & sharpness scales to the current image and record it.
+            Returns the new image """
+
+        return self.record(Command('Scales', {'brightness': brightness, 'contrast': contrast, 'sharpness': sharpness}))
+
+
+    def record(self, command):
+        """ Apply a command to the current image and add it to the history.
+            Anything that could have been redone is thrown away.
+            Throws an error, without changing the history, if the command can't be applied """
+
+        if not filter_registry.exists(command.filter):
+            raise ValueError(f'unknown filter {command.filter!r}')
+
+        image = command.apply(self.image_processor, self.current_image)
+        if image is None:
+            raise ValueError(f'{command.filter} returned no image')
+
+        deterministic = command.is_deterministic()
+
+        del self.commands[self.position:]
+        for index in [index for index in self.checkpoints if index > self.position]:
+            del self.checkpoints[index]
+
+        self.commands.append(command)
+        self.position = self.position + 1
+
+        if self.position % self.checkpoint_interval == 0 or not deterministic:
+            self.checkpoints[self.position] = image
+
+        self.current_image = image
+
+        return image
+
+
+    def undo(self, n=1):
+        """ Undo the last N commands (defaults to 1) and return the resulting image.
+            Throws an error, without changing anything, if there are fewer than N commands """
+
+        if n < 1:
+            raise ValueError(f'can not undo {n} commands')
+
+        if n > self.get_undo_size():
+            raise EmptyCommandStackError()
+
+        return self.move_to(self.position - n)
+
+
+    def redo(self, n=1):
+        """ Redo the last N undone commands (defaults to 1) and return the resulting image.
+            Throws an error, without changing anything, if there are fewer than N commands """
+
+        if n < 1:
+            raise ValueError(f'can not redo {n} commands')
+
+        if n > self.get_redo_size():
+            raise EmptyCommandStackError()
+
+        return self.move_to(self.position + n)
+
+
+    def move_to(self, position):
+        """ Rebuild the image after the first N commands by replaying from the nearest checkpoint """
+
+        # Redoing forwards can start from the current image if no checkpoint is closer
+        start = max(index for index in self.checkpoints if index <= position)
+        image = self.checkpoints[start]
+
+        if self.position <= position and self.position > start:
+            start = self.position
+            image = self.current_image
+
+        for command in self.commands[start:position]:
+            image = command.apply(self.image_processor, image)
+
+        self.position = position
+        self.current_image = image
+
+        return image
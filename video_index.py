@@ -0,0 +1,260 @@
+"""
+File: video_index.py
+Author: Adam Applegate
+Description:
+
+    Builds an index of a video's frames: how many there are, when each one
+    is shown, and which are keyframes. The index is built once per file by
+    reading the compressed packets without decoding them, and is stored in
+    temp/ so reopening the file is instant. With it, any frame can be decoded
+    by seeking to the keyframe before it and decoding forward, instead of
+    reading the video from the start
+
+"""
+
+import bisect
+import json
+import os
+import threading
+
+import cv2
+
+import instrumentation
+from image_processor import make_proxy
+from result_cache import file_key
+
+# Where indexes are stored
+INDEX_DIR = 'temp/video_index'
+
+# Bumped whenever the stored format changes, so old indexes are rebuilt
+INDEX_VERSION = 1
+
+# Frame rate to use when the file doesn't report one
+DEFAULT_FPS = 30.0
+
+
+class VideoIndex():
+    """ The frame count, frame timestamps and keyframe positions of a video file """
+
+    def __init__(self, filepath, fps, width, height, timestamps, keyframes):
+        self.filepath = filepath
+
+        self.fps = fps
+        self.width = width
+        self.height = height
+
+        # When each frame is shown, in seconds
+        self.timestamps = timestamps
+
+        # Indexes of the frames that can be decoded on their own, in order.
+        # None if the backend can't report them, in which case its own seeking is trusted
+        self.keyframes = keyframes
+
+
+    @property
+    def frame_count(self):
+        return len(self.timestamps)
+
+
+    @property
+    def duration(self):
+        """ Length of the video in seconds """
+
+        if self.frame_count == 0:
+            return 0.0
+
+        return self.timestamps[-1] + 1 / self.fps
+
+
+    def keyframe_before(self, frame_index):
+        """ Returns the last keyframe at or before a frame """
+
+        if not self.keyframes:
+            return frame_index
+
+        position = bisect.bisect_right(self.keyframes, frame_index) - 1
+
+        return self.keyframes[max(position, 0)]
+
+
+    def frame_at(self, seconds):
+        """ Returns the index of the frame on screen at a time, in seconds """
+
+        position = bisect.bisect_right(self.timestamps, seconds) - 1
+
+        return max(0, min(position, self.frame_count - 1))
+
+
+    def to_dict(self):
+        return {
+            'version': INDEX_VERSION,
+            'fps': self.fps,
+            'width': self.width,
+            'height': self.height,
+            'timestamps': self.timestamps,
+            'keyframes': self.keyframes,
+        }
+
+
+def index_path(filepath, index_dir=INDEX_DIR):
+    name = os.path.splitext(os.path.basename(filepath))[0]
+
+    return os.path.join(index_dir, f'{name}-{file_key(filepath)}.json')
+
+
+@instrumentation.timed('video_index.build')
+def build_index(filepath):
+    """ Reads every packet of a video, without decoding, and returns its VideoIndex """
+
+    video = cv2.VideoCapture(filepath)
+    if not video.isOpened():
+        raise IOError(f'could not open {filepath}')
+
+    fps = video.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+    width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    # Raw mode hands back the compressed packets, which is far faster than decoding them.
+    # Not every backend supports it, and without it keyframes can't be told apart
+    raw = video.set(cv2.CAP_PROP_FORMAT, -1)
+
+    timestamps = []
+    keyframes = [] if raw else None
+
+    while video.grab():
+        if raw and video.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+            keyframes.append(len(timestamps))
+
+        timestamps.append(video.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+
+    video.release()
+
+    # Packets arrive in decode order. Frames are shown in timestamp order, which differs when a codec
+    # uses B-frames. Keyframes start closed groups of frames, so their positions are the same in both
+    timestamps.sort()
+
+    # The first frame has to be decodable on its own, even if the container didn't flag it
+    if keyframes is not None and (len(keyframes) == 0 or keyframes[0] != 0) and len(timestamps) > 0:
+        keyframes.insert(0, 0)
+
+    return VideoIndex(filepath, fps, width, height, timestamps, keyframes)
+
+
+def load_index(filepath, index_dir=INDEX_DIR):
+    """ Returns the VideoIndex for a file, reading it from index_dir if it was built before.
+        Otherwise it's built and stored there """
+
+    path = index_path(filepath, index_dir)
+
+    try:
+        with open(path) as file:
+            data = json.load(file)
+
+        if data.get('version') == INDEX_VERSION:
+            return VideoIndex(filepath, data['fps'], data['width'], data['height'], data['timestamps'], data['keyframes'])
+
+    # Missing or unreadable. Build it again
+    except (OSError, ValueError, KeyError):
+        pass
+
+    index = build_index(filepath)
+
+    os.makedirs(index_dir, exist_ok=True)
+
+    # Write to a temporary name first, so a half written index is never read
+    with open(path + '.tmp', 'w') as file:
+        json.dump(index.to_dict(), file)
+    os.replace(path + '.tmp', path)
+
+    return index
+
+
+def seek(video, index, frame_index, position=None):
+    """ Positions a VideoCapture so its next read() returns frame_index.
+        position is the index of the frame read() would return now, if known. Reading forward from it is
+        cheaper than seeking when no keyframe lies between it and the target """
+
+    if index is None or index.keyframes is None:
+        video.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+        return
+
+    keyframe = index.keyframe_before(frame_index)
+
+    if position is None or position < keyframe or position > frame_index:
+        video.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+        position = keyframe
+
+    # Frames before the target still have to be decoded, but don't need to be copied out
+    while position < frame_index and video.grab():
+        position = position + 1
+
+
+class FrameReader():
+    """ Decodes single frames of a video at any position. Safe to share between threads.
+        Seeking is only frame accurate once the reader has the file's index """
+
+    def __init__(self, filepath, index=None):
+        self.filepath = filepath
+
+        # The file's VideoIndex. Can be set later, once it has been built
+        self.index = index
+
+        self.video = cv2.VideoCapture(filepath)
+        self.fps = self.video.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+
+        # The frame the next read() returns
+        self.position = 0
+
+        self.lock = threading.Lock()
+
+
+    def set_index(self, index):
+        """ Gives the reader the file's index, once it has been built """
+
+        with self.lock:
+            self.index = index
+
+
+    def read(self, frame_index):
+        """ Returns the BGR frame at an index """
+
+        with self.lock:
+            frame_index = max(0, int(frame_index))
+            if self.index is not None:
+                frame_index = min(frame_index, self.index.frame_count - 1)
+
+            with instrumentation.span('video_index.read'):
+                seek(self.video, self.index, frame_index, self.position)
+
+                ret, frame = self.video.read()
+
+            if ret == False:
+                # The capture is in an unknown state, so seek next time
+                self.position = None
+                raise IOError(f'could not read frame {frame_index} of {self.filepath}')
+
+            self.position = frame_index + 1
+
+            return frame
+
+
+    def read_at(self, seconds):
+        """ Returns the BGR frame on screen at a time, in seconds """
+
+        if self.index is None:
+            return self.read(seconds * self.fps)
+
+        return self.read(self.index.frame_at(seconds))
+
+
+    def thumbnail(self, seconds, max_width, max_height):
+        """ Returns the frame on screen at a time, shrunk to fit within max_width x max_height """
+
+        thumbnail, _ = make_proxy(self.read_at(seconds), max_width, max_height)
+
+        return thumbnail
+
+
+    def release(self):
+        with self.lock:
+            self.video.release()
@@ -0,0 +1,248 @@
+"""
+File: video_player.py
+Author: Adam Applegate
+Description: 
+
+    Plays videos without blocking the Tk event loop. A background thread
+    decodes frames into a small buffer, and the Tk after() scheduler shows
+    them at the file's frame rate, dropping frames when drawing falls behind
+   
+"""
+
+import queue
+import threading
+import time
+
+import cv2
+
+import video_index
+
+# How many decoded frames to keep ready ahead of the playback position
+BUFFER_SIZE = 8
+
+
+class VideoPlayer():
+    """ Plays a video file by passing each frame to a callback on the Tk main thread """
+
+    def __init__(self, widget, filepath, on_frame, on_finished=None, buffer_size=BUFFER_SIZE, index=None):
+        # Any Tk widget, used for its after() scheduler
+        self.widget = widget
+
+        # on_frame(frame, frame_index) is called with each BGR frame that should be shown
+        self.on_frame = on_frame
+        self.on_finished = on_finished
+
+        self.video = cv2.VideoCapture(filepath)
+
+        # The file's VideoIndex, if it has been built. Makes seeking frame accurate
+        self.index = index
+
+        if index is not None:
+            self.fps = index.fps
+            self.frame_count = index.frame_count
+        else:
+            self.fps = self.video.get(cv2.CAP_PROP_FPS) or video_index.DEFAULT_FPS
+            self.frame_count = int(self.video.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        self.playing = False
+        self.frames_dropped = 0
+
+        # The index of the last frame that was shown
+        self.position = -1
+
+        # Wall clock time and frame index that playback timing is measured from
+        self._clock_start = 0.0
+        self._clock_frame = 0
+
+        # Bumped on every seek, so frames decoded before the seek can be thrown away
+        self._generation = 0
+        self._seek_to = None
+        self._finished_decoding = False
+
+        self._buffer = queue.Queue(maxsize=buffer_size)
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._after_id = None
+
+        self._decoder = threading.Thread(target=self._decode, daemon=True)
+        self._decoder.start()
+
+
+    def play(self):
+        """ Starts or resumes playback from the current position """
+
+        if self.playing:
+            return
+
+        self.playing = True
+        self._reset_clock(self.position + 1)
+
+        # A seek may already have a tick pending. Replace it, so only one chain of ticks runs
+        self._cancel()
+        self._schedule(0)
+
+
+    def pause(self):
+        """ Pauses playback, keeping the current position """
+
+        self.playing = False
+        self._cancel()
+
+
+    def toggle(self):
+        """ Pauses if playing, plays if paused """
+
+        if self.playing:
+            self.pause()
+        else:
+            self.play()
+
+
+    def seek(self, frame_index):
+        """ Jumps to a frame. The frame is shown even while paused """
+
+        frame_index = max(0, min(int(frame_index), max(self.frame_count - 1, 0)))
+
+        with self._lock:
+            self._generation = self._generation + 1
+            self._seek_to = frame_index
+            self._finished_decoding = False
+
+        # Throw away frames that were decoded before the seek
+        self._drain()
+
+        self.position = frame_index - 1
+        self._reset_clock(frame_index)
+
+        # Show the new frame right away, even when paused
+        self._cancel()
+        self._schedule(0)
+
+
+    def seek_seconds(self, seconds):
+        """ Moves the playback position forwards (or backwards, if negative) by a number of seconds """
+
+        self.seek(self.position + seconds * self.fps)
+
+
+    def close(self):
+        """ Stops playback and releases the video file """
+
+        self.pause()
+        self._closed.set()
+        self._drain()
+        self._decoder.join()
+        self.video.release()
+
+
+    def _reset_clock(self, frame_index):
+        self._clock_start = time.perf_counter()
+        self._clock_frame = frame_index
+
+
+    def _schedule(self, delay):
+        self._after_id = self.widget.after(max(int(delay * 1000), 1), self._tick)
+
+
+    def _cancel(self):
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+            self._after_id = None
+
+
+    def _tick(self):
+        """ Runs on the Tk main thread. Shows the frame that is due now, dropping any that are late """
+
+        self._after_id = None
+
+        # The frame that should be on screen at this moment
+        due_frame = self._clock_frame + int((time.perf_counter() - self._clock_start) * self.fps)
+
+        frame = None
+        frame_index = self.position
+        while True:
+            try:
+                generation, index, next_frame = self._buffer.get_nowait()
+            except queue.Empty:
+                break
+
+            # Decoded before a seek
+            if generation != self._generation:
+                continue
+
+            if frame is not None:
+                self.frames_dropped = self.frames_dropped + 1
+
+            frame = next_frame
+            frame_index = index
+
+            # Stop once the due frame is reached, or right away when paused (showing a seek)
+            if index >= due_frame or not self.playing:
+                break
+
+        if frame is not None:
+            self.position = frame_index
+            self.on_frame(frame, frame_index)
+
+        if self._finished_decoding and self._buffer.empty() and frame is None:
+            self.playing = False
+            if self.on_finished is not None:
+                self.on_finished()
+            return
+
+        if self.playing:
+            # Wake up when the next frame is due
+            next_due = self._clock_start + (self.position + 1 - self._clock_frame) / self.fps
+            self._schedule(next_due - time.perf_counter())
+
+        elif frame is None:
+            # Paused after a seek, but the frame isn't decoded yet
+            self._schedule(1 / self.fps)
+
+
+    def _decode(self):
+        """ Runs on the decoder thread. Keeps the buffer filled with upcoming frames """
+
+        frame_index = 0
+
+        while not self._closed.is_set():
+            with self._lock:
+                generation = self._generation
+                seek_to = self._seek_to
+                self._seek_to = None
+
+            if seek_to is not None:
+                video_index.seek(self.video, self.index, seek_to, frame_index)
+                frame_index = seek_to
+
+            if self._finished_decoding:
+                # Wait for a seek or for the player to close
+                self._closed.wait(0.05)
+                continue
+
+            ret, frame = self.video.read()
+
+            if ret == False:
+                with self._lock:
+                    if generation == self._generation:
+                        self._finished_decoding = True
+                continue
+
+            item = (generation, frame_index, frame)
+            frame_index = frame_index + 1
+
+            # Wait for room in the buffer, unless a seek makes this frame stale
+            while not self._closed.is_set() and generation == self._generation:
+                try:
+                    self._buffer.put(item, timeout=0.05)
+                    break
+                except queue.Full:
+                    pass
+
+
+    def _drain(self):
+        while True:
+            try:
+                self._buffer.get_nowait()
+            except queue.Empty:
+                return
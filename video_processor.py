@@ -7,53 +7,260 @@ Description:
    
 """
 
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import cv2
 
+import instrumentation
+import pixel_format
+from image_processor import ImageProcessor
+
+# Marks the end of the frames in a pipeline queue
+END_OF_STREAM = None
+
+# How many frames each worker process may have queued or in progress at once
+FRAMES_PER_WORKER = 2
+
+# One processor per worker process, created by init_worker
+worker_processor = None
+
+
+def worker_context():
+    """ Returns the multiprocessing context for filter workers. Workers must not be forked, because
+        the pipeline (and the UI) already run threads that may hold locks inside OpenCV or Tk.
+        forkserver starts them from a clean server process, and spawn from a fresh interpreter """
+
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+
+    return multiprocessing.get_context('spawn')
+
+
+def init_worker():
+    """ Sets up a filter worker process """
+
+    global worker_processor
+    worker_processor = VideoProcessor()
+
+    # Each process gets its own core, so keep OpenCV from spawning threads of its own
+    cv2.setNumThreads(1)
+
+
+def filter_frame_worker(filter, frame):
+    """ Filters a frame inside a worker process """
+
+    return worker_processor.filter_frame(filter, frame)
+
+
 class VideoProcessor():
     def __init__(self):
-       super.__init__
+        # Every frame is new, so memoizing filter stages would only hash frames and churn memory
+        self.image_processor = ImageProcessor(memoize=False)
 
+        self.filename = None
 
-    def filter_video(self, filter):
-        video = cv2.VideoCapture(self.filename)
+
+    def filter_video(self, filter, filename=None, output_path='temp/processed_video.mp4', save_frames=False,
+                     queue_size=16, progress_interval=1.0, workers=1):
+        """ Applies a filter to every frame of a video and writes the result to output_path.
+
+            Decoding, filtering and encoding run in separate threads connected by bounded
+            queues, so the whole pipeline only goes as slow as its slowest stage.
+            Set save_frames to also write every filtered frame to temp/frames/ as a PNG.
+
+            With workers > 1 frames are filtered in parallel by a process pool. Results are
+            written in their original order, and at most FRAMES_PER_WORKER frames per worker
+            are in flight, so memory stays flat no matter how long the video is. Workers are started
+            without forking, so a script calling this with workers > 1 needs an
+            if __name__ == '__main__' guard """
+
+        filename = filename or self.filename
+
+        video = cv2.VideoCapture(filename)
+        if not video.isOpened():
+            raise IOError(f'could not open {filename}')
 
         frame_width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
         frame_height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
         frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-        fps = int(video.get(cv2.CAP_PROP_FPS))
+        fps = video.get(cv2.CAP_PROP_FPS)
+
+        video_writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (frame_width, frame_height))
+        if not video_writer.isOpened():
+            video.release()
+            raise IOError(f'could not write {output_path}')
+
+        if save_frames:
+            os.makedirs('temp/frames', exist_ok=True)
+
+        decoded_frames = queue.Queue(maxsize=queue_size)
+        filtered_frames = queue.Queue(maxsize=queue_size)
+
+        # Set when any stage fails, so the other stages stop instead of waiting forever
+        stop = threading.Event()
+        errors = []
+
+        decoder = threading.Thread(target=self.decode_frames, args=(video, decoded_frames, stop, errors), daemon=True)
+        encoder = threading.Thread(target=self.encode_frames, args=(video_writer, filtered_frames, save_frames, stop, errors), daemon=True)
 
-        video_writer = cv2.VideoWriter('temp/processed_video.mp4', cv2.VideoWriter_fourcc(*'mp4v'), fps, (frame_width, frame_height))
         print('Processing video...')
-         
+        start = time.perf_counter()
+        last_report = start
+
+        # Filtered frames that haven't been handed to the encoder yet, in order
+        executor = None
+        pending_frames = deque()
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=worker_context(), initializer=init_worker)
+
+        decoder.start()
+        encoder.start()
+
         frame_num = 0
-        while(video.isOpened()):
-            ret, frame = video.read()
+        try:
+            while True:
+                frame = self.get_frame(decoded_frames, stop)
+                if frame is END_OF_STREAM:
+                    break
+
+                if executor is None:
+                    processed_frames = [self.filter_frame(filter, frame)]
+
+                else:
+                    pending_frames.append(executor.submit(filter_frame_worker, filter, frame))
+
+                    # Wait for the oldest frame only once the reorder buffer is full
+                    processed_frames = []
+                    if len(pending_frames) >= workers * FRAMES_PER_WORKER:
+                        processed_frames.append(pending_frames.popleft().result())
+
+                for processed_frame in processed_frames:
+                    frame_num = frame_num + 1
+                    self.put_frame(filtered_frames, processed_frame, stop)
+
+                # Report progress at most once per progress_interval
+                now = time.perf_counter()
+                if now - last_report >= progress_interval:
+                    last_report = now
+                    print(f'Filtered {frame_num}/{frame_count} frames ({frame_num / (now - start):.1f} fps)')
+
+            # Collect anything still in flight
+            while len(pending_frames) > 0 and not stop.is_set():
+                frame_num = frame_num + 1
+                self.put_frame(filtered_frames, pending_frames.popleft().result(), stop)
+
+        except Exception as error:
+            errors.append(error)
+            stop.set()
+
+        finally:
+            self.put_frame(filtered_frames, END_OF_STREAM, stop)
+
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+            decoder.join()
+            encoder.join()
+
+            video.release()
+            video_writer.release()
+
+        if len(errors) > 0:
+            raise errors[0]
+
+        elapsed = time.perf_counter() - start
+        print(f'Video processed! {frame_num} frames in {elapsed:.2f} s')
+
+        return output_path
+
+
+    @instrumentation.timed('video_processor.filter_frame')
+    def filter_frame(self, filter, frame):
+        """ Filters a single frame, making sure the result can be written to a color video """
+
+        processed_frame = self.image_processor.filter_image(filter, frame)
+
+        if processed_frame is None:
+            raise ValueError(f'Unknown filter: {filter}')
+
+        # Grayscale filters need to be converted back to 3 channels for the video writer
+        processed_frame = pixel_format.for_video(processed_frame)
+
+        return processed_frame.astype(np.uint8, copy=False)
+
+
+    def decode_frames(self, video, decoded_frames, stop, errors):
+        """ Decoder stage. Reads frames until the video ends """
+
+        try:
+            while not stop.is_set():
+                with instrumentation.span('video_processor.decode'):
+                    ret, frame = video.read()
+
+                #If a frame isn't read properly, the video is finished
+                if ret == False:
+                    break
+
+                self.put_frame(decoded_frames, frame, stop)
+
+        except Exception as error:
+            errors.append(error)
+            stop.set()
+
+        finally:
+            self.put_frame(decoded_frames, END_OF_STREAM, stop)
+
+
+    def encode_frames(self, video_writer, filtered_frames, save_frames, stop, errors):
+        """ Encoder stage. Writes frames until the end of the stream """
+
+        frame_num = 0
+        try:
+            while True:
+                frame = self.get_frame(filtered_frames, stop)
+                if frame is END_OF_STREAM:
+                    break
 
-            if ret == True and frame_num <= frame_count:
                 frame_num = frame_num + 1
-                print(f'attempting to filter frame #{frame_num}')
-                self.filter_image(filter, frame)
+                with instrumentation.span('video_processor.encode'):
+                    video_writer.write(frame)
+
+                if save_frames:
+                    with instrumentation.span('video_processor.save_frame'):
+                        cv2.imwrite('temp/frames/frame{}.png' .format(frame_num), frame)
+
+        except Exception as error:
+            errors.append(error)
+            stop.set()
+
 
-                image = np.array(self.current_media)
-                cv_image = image.astype(np.uint8)
+    def put_frame(self, frames, frame, stop):
+        """ Adds a frame to a queue, giving up if the pipeline was stopped """
 
+        while True:
+            try:
+                frames.put(frame, timeout=0.1)
+                return
 
-                cv2.imwrite('temp/frames/frame{}.png' .format(frame_num), cv_image)
-                video_writer.write(cv_image)
+            except queue.Full:
+                if stop.is_set():
+                    return
 
-            
-            elif (frame_num == frame_count):
-                print('Finished processing video.')
-                break
 
-            #If a frame isn't read properly, exit the loop
-            else:
-                print('Error reading file.')
-                break
+    def get_frame(self, frames, stop):
+        """ Takes the next frame from a queue. Returns END_OF_STREAM if the pipeline was stopped """
 
-        print('Video processed!')
-        video.release()
-        video_writer.release()
+        while True:
+            try:
+                return frames.get(timeout=0.1)
 
-        self.update_media('temp/processed_video.mp4')
\ No newline at end of file
+            except queue.Empty:
+                if stop.is_set():
+                    return END_OF_STREAM